@@ -0,0 +1,64 @@
+// Messages of the kinds seen in Slack channels where math is discussed.
+// Each message has its text, where newlines stand for the <br> elements
+// Slack shows line breaks as, optionally a code span or a code block that
+// follows the text, and the number of equations the payload should find in
+// it. Bump the
+// version whenever messages are added, removed or changed, so that results
+// from different corpora are not compared.
+var corpus = {
+  version: 2,
+  plain: [
+    { text: 'Plain message without any math, which most messages are.', equations: 0 },
+    { text: 'Meeting moved to 3pm, same room as last week.', equations: 0 },
+    { text: 'Thanks! That fixed it.', equations: 0 },
+    { text: 'Can someone review my pull request before Friday? It touches the data loader and the plotting code.', equations: 0 },
+    { text: 'Has anyone seen the slides from the reading group?', equations: 0 },
+    { text: 'I will be out tomorrow, ping me by email if anything breaks.', equations: 0 }
+  ],
+  // Dollar signs that are not math
+  currency: [
+    { text: 'Lunch was $12 and parking $5, so about $17 in total.', equations: 0 },
+    { text: 'The grant covers $2,500 for travel and $1,000 for equipment.', equations: 0 },
+    { text: 'Coffee is $3.50 now, up from $3 last year.', equations: 0 },
+    { text: 'Between $5 and 10$ a month, depending on the plan.', equations: 0 },
+    { text: 'Budget: $ 400 for the workshop and $ 150 for snacks.', equations: 0 }
+  ],
+  escaped: [
+    { text: 'Write \\$ to get a dollar sign, e.g., \\$HOME.', equations: 0 },
+    { text: 'The bill came to \\$40 and \\$x\\$ stays as it is.', equations: 0 }
+  ],
+  // Dollar signs in code are left alone
+  code: [
+    { text: 'Try this in your shell: ', code: 'echo $PATH | tr : \\\\n', equations: 0 },
+    { text: 'The prompt is set with ', code: 'export PS1="$USER@$HOSTNAME $ "', equations: 0 },
+    { text: 'In R, select a column with ', code: 'df$x + df$y', equations: 0 },
+    { text: 'My build script:', pre: 'for f in $(ls *.tex); do\n  pdflatex "$f" && echo "built ${f%.tex}"\ndone', equations: 0 },
+    { text: 'Here is the raw markdown, so you can see what I typed:', pre: '$$\\sum_{i=1}^n x_i$$ and $\\alpha$', equations: 0 }
+  ],
+  inline: [
+    { text: 'Did anyone check whether $\\alpha + \\beta = \\gamma$ holds in the last run?', equations: 1 },
+    { text: 'So $x_1, \\dots, x_n$ are iid with mean $\\mu$ and variance $\\sigma^2$.', equations: 3 },
+    { text: 'The estimator is $\\hat\\theta = \\bar{X}$, unbiased for $\\theta$.', equations: 2 },
+    { text: 'It runs in $O(n \\log n)$ time and $O(n)$ space.', equations: 2 },
+    { text: 'Isn\'t $2^{10}=1024$?', equations: 1 },
+    { text: 'Set $\\epsilon = 10^{-6}$ and $\\delta = \\epsilon / 2$.', equations: 2 },
+    { text: 'For $n \\geq 2$, $\\binom{n}{2} = \\frac{n(n-1)}{2}$.', equations: 2 },
+    { text: 'Use $\\mathbb{E}[X \\mid Y]$ here, not $\\mathbb{E}[X]$.', equations: 2 }
+  ],
+  display: [
+    { text: 'The loss is $$\\mathcal{L}(\\theta) = \\sum_{i=1}^n \\ell(f_\\theta(x_i), y_i) + \\lambda \\|\\theta\\|^2$$ with weight decay.', equations: 1 },
+    { text: 'Recall that $$\\int_{-\\infty}^{\\infty} e^{-x^2} \\, dx = \\sqrt{\\pi}.$$', equations: 1 },
+    { text: 'The update is $$\\theta_{t+1} = \\theta_t - \\eta \\nabla_\\theta \\mathcal{L}(\\theta_t)$$ and $\\eta$ decays.', equations: 2 },
+    { text: '$$P(A \\mid B) = \\frac{P(B \\mid A) P(A)}{P(B)}$$', equations: 1 },
+    { text: 'Covariance: $$\\Sigma = \\begin{pmatrix} \\sigma_1^2 & \\rho \\sigma_1 \\sigma_2 \\\\ \\rho \\sigma_1 \\sigma_2 & \\sigma_2^2 \\end{pmatrix}$$', equations: 1 }
+  ],
+  // Long multi-line environments
+  align: [
+    { text: 'See $$\\begin{aligned} a &= b + c \\\\ d &= e + f \\end{aligned}$$ for the derivation.', equations: 1 },
+    { text: 'Expanding, $$\\begin{aligned} (a + b)^3 &= (a + b)(a + b)^2 \\\\ &= (a + b)(a^2 + 2ab + b^2) \\\\ &= a^3 + 3a^2b + 3ab^2 + b^3 \\end{aligned}$$ as expected.', equations: 1 },
+    { text: 'The bound follows from $$\\begin{aligned} \\Pr\\left(\\left|\\frac{1}{n}\\sum_{i=1}^n X_i - \\mu\\right| \\geq t\\right) &\\leq 2 \\exp\\left(-\\frac{2 n t^2}{(b - a)^2}\\right) \\\\ &\\leq \\delta \\quad \\text{when} \\quad t \\geq (b - a) \\sqrt{\\frac{\\log(2 / \\delta)}{2n}} \\end{aligned}$$ by Hoeffding.', equations: 1 },
+    { text: 'So the recurrence is\n$$\n\\begin{aligned}\nT(n) &= 2T(n / 2) + n \\\\\n&= n \\log_2 n\n\\end{aligned}\n$$\nby the master theorem.', equations: 1 },
+    { text: 'Two steps:\n1. $u = x^2$\n2. $du = 2x\\,dx$\nthen substitute.', equations: 2 },
+    { text: '$$\\begin{aligned} f(x) &= \\sum_{k=0}^\\infty \\frac{f^{(k)}(a)}{k!} (x - a)^k \\\\ &= f(a) + f\'(a)(x - a) + \\frac{f\'\'(a)}{2}(x - a)^2 + \\cdots \\end{aligned}$$', equations: 1 }
+  ]
+};
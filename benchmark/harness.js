@@ -0,0 +1,146 @@
+// Replays what Slack does to a channel against the payload: opening a
+// channel with a backlog, new messages arriving one at a time, edits and
+// switching to another channel. For each phase, the time until everything
+// is rendered, the long tasks seen meanwhile and the mutations the payload
+// processed are reported, along with how many equations were found against
+// how many the corpus says there are. Options are read from the query
+// string: messages (in the backlog), arrivals and edits (per phase),
+// interval (ms between arrivals and edits), and density and seed (see
+// messages.js).
+
+var params = new URLSearchParams(window.location.search);
+var options = {
+  messages: Number(params.get('messages') || 500),
+  arrivals: Number(params.get('arrivals') || 20),
+  edits: Number(params.get('edits') || 20),
+  interval: Number(params.get('interval') || 50),
+  density: Number(params.get('density') || 0.3),
+  seed: Number(params.get('seed') || 1)
+};
+var messages = generator(options.seed, options.density);
+
+// Long tasks block Slack's main thread for more than 50 ms
+var long_tasks = [];
+if (window.PerformanceObserver &&
+    PerformanceObserver.supportedEntryTypes &&
+    PerformanceObserver.supportedEntryTypes.indexOf('longtask') >= 0) {
+  new PerformanceObserver(function (list) {
+    long_tasks = long_tasks.concat(list.getEntries());
+  }).observe({ entryTypes: ['longtask'] });
+}
+
+function channel() {
+  return document.getElementById('msgs_div');
+}
+
+// Rendered equations, and those shown as raw TeX for being over limits
+function count_equations() {
+  return channel().querySelectorAll('.MathJax, mjx-container, .katex, .mws-raw').length;
+}
+
+// The payload is done when nothing is left to typeset. The engine is
+// loaded on demand, so the first phase also waits for it.
+function wait_idle(callback) {
+  window.setTimeout(function check() {
+    if (window.mathWithSlack.pending() === 0) {
+      callback();
+    } else {
+      window.setTimeout(check, 5);
+    }
+  }, 5);
+}
+
+function measure(name, action, callback) {
+  var filter = window.mathWithSlack.filter();
+  var tasks = long_tasks.length;
+  var start = performance.now();
+  action(function () {
+    wait_idle(function () {
+      var after = window.mathWithSlack.filter();
+      var blocked = long_tasks.slice(tasks).map(function (task) { return task.duration; });
+      callback({
+        phase: name,
+        ms: Math.round(performance.now() - start),
+        long_tasks: blocked.length,
+        long_task_ms: Math.round(blocked.reduce(function (a, b) { return a + b; }, 0)),
+        mutations: {
+          checked: after.checked - filter.checked,
+          rejected: after.rejected - filter.rejected,
+          unchanged: after.unchanged - filter.unchanged,
+          ignored: after.ignored - filter.ignored
+        },
+        equations: { expected: expected_equations(channel()), found: count_equations() }
+      });
+    });
+  });
+}
+
+// Runs step(i) count times, interval ms apart
+function repeat(count, step, done) {
+  var i = 0;
+  (function next() {
+    if (i === count) {
+      done();
+      return;
+    }
+    step(i++);
+    window.setTimeout(next, options.interval);
+  })();
+}
+
+var phases = [
+  ['channel_open', function (done) {
+    channel().appendChild(make_channel(options.messages, messages));
+    done();
+  }],
+  ['new_messages', function (done) {
+    repeat(options.arrivals, function (i) {
+      channel().appendChild(make_message(messages.next()));
+    }, done);
+  }],
+  ['edits', function (done) {
+    // Slack redraws the body of an edited message with the new text
+    var items = channel().querySelectorAll('.c-virtual_list__item');
+    repeat(options.edits, function (i) {
+      var item = items[items.length - 1 - i];
+      item.setAttribute('data-equations', 2);
+      item.querySelector('.c-message__body').textContent =
+        'Edited: $e^{i\\pi} + ' + i + ' = ' + (i - 1) + '$ and $$\\int_0^' + i + ' x\\,dx$$';
+    }, done);
+  }],
+  ['channel_switch', function (done) {
+    channel().textContent = '';
+    channel().appendChild(make_channel(options.messages, generator(options.seed + 1, options.density)));
+    done();
+  }]
+];
+
+function run() {
+  var results = {
+    benchmark: 'harness',
+    date: new Date().toISOString(),
+    corpus: corpus.version,
+    options: options,
+    phases: []
+  };
+  (function next(i) {
+    if (i === phases.length) {
+      results.cache = window.mathWithSlack.cache();
+      results.stats = window.mathWithSlack.stats();
+      results.timeline = window.mathWithSlack.timeline();
+      document.getElementById('results').textContent = JSON.stringify(results, null, 2);
+      console.log(JSON.stringify(results));
+      document.title = 'done';
+      return;
+    }
+    measure(phases[i][0], phases[i][1], function (result) {
+      results.phases.push(result);
+      next(i + 1);
+    });
+  })(0);
+}
+
+window.addEventListener('load', function () {
+  // Leave the payload time to start observing the channel
+  window.setTimeout(run, 1000);
+});
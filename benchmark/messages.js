@@ -0,0 +1,83 @@
+// Synthetic Slack channels made from the messages in corpus.js. A generator
+// draws messages at random, with a fixed seed so that runs can be compared;
+// density is the share of messages with math.
+
+var math_kinds = [['inline', 0.6], ['display', 0.25], ['align', 0.15]];
+var other_kinds = [['plain', 0.7], ['currency', 0.12], ['code', 0.12], ['escaped', 0.06]];
+
+function generator(seed, density) {
+  var state = seed >>> 0;
+  // mulberry32
+  function random() {
+    state = (state + 0x6d2b79f5) >>> 0;
+    var t = state;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  }
+  function pick(kinds) {
+    var r = random();
+    for (var i = 0; i < kinds.length - 1 && r >= kinds[i][1]; i++) {
+      r -= kinds[i][1];
+    }
+    var messages = corpus[kinds[i][0]];
+    return messages[Math.floor(random() * messages.length)];
+  }
+  return {
+    next: function () {
+      return pick(random() < density ? math_kinds : other_kinds);
+    }
+  };
+}
+
+// Text with its line breaks as <br> elements, as Slack shows them
+function append_lines(parent, text) {
+  text.split('\n').forEach(function (line, i) {
+    if (i > 0) {
+      parent.appendChild(document.createElement('br'));
+    }
+    parent.appendChild(document.createTextNode(line));
+  });
+}
+
+// A message as Slack lays it out: a list item holding the message, whose
+// body holds the text and any code. The item records how many equations it
+// holds.
+function make_message(entry) {
+  var item = document.createElement('div');
+  item.className = 'c-virtual_list__item';
+  item.setAttribute('data-equations', entry.equations);
+  var message = document.createElement('div');
+  message.className = 'c-message';
+  var body = document.createElement('span');
+  body.className = 'c-message__body';
+  append_lines(body, entry.text);
+  if (entry.code) {
+    var code = document.createElement('code');
+    code.textContent = entry.code;
+    body.appendChild(code);
+  }
+  if (entry.pre) {
+    var pre = document.createElement('pre');
+    append_lines(pre, entry.pre);
+    body.appendChild(pre);
+  }
+  message.appendChild(body);
+  item.appendChild(message);
+  return item;
+}
+
+function make_channel(count, messages) {
+  var fragment = document.createDocumentFragment();
+  for (var i = 0; i < count; i++) {
+    fragment.appendChild(make_message(messages.next()));
+  }
+  return fragment;
+}
+
+// Number of equations the payload should find under node
+function expected_equations(node) {
+  return Array.prototype.reduce.call(node.querySelectorAll('[data-equations]'), function (sum, item) {
+    return sum + Number(item.getAttribute('data-equations'));
+  }, 0);
+}
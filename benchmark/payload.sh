@@ -0,0 +1,30 @@
+#!/usr/bin/env bash
+
+################################################################################
+# Build the math-with-slack payload for the benchmarks
+################################################################################
+#
+# Installs math-with-slack into benchmark/build, which stands in for Slack's
+# static folder, so that the payload (and MathJax or KaTeX, if installed
+# locally) ends up next to the benchmark pages. All arguments are passed on
+# to math-with-slack.sh, e.g., --local MathJax-2.7.4.zip.
+#
+################################################################################
+
+BENCHMARK_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+BUILD_DIR="$BENCHMARK_DIR/build"
+
+rm -rf "$BUILD_DIR"
+mkdir -p "$BUILD_DIR"
+
+# Just enough of ssb-interop.js for the installer to accept the folder
+printf "const path = require('path');\ninit(resourcePath, mainModule, !isDevMode);\n" > "$BUILD_DIR/ssb-interop.js"
+
+bash "$BENCHMARK_DIR/../math-with-slack.sh" "$@" "$BUILD_DIR" > /dev/null 2>&1
+
+if [ ! -e "$BUILD_DIR/math-with-slack.js" ]; then
+	echo "Cannot build the payload; run math-with-slack.sh $* $BUILD_DIR to see why."
+	exit 1
+fi
+
+echo "Payload built at: $BUILD_DIR"
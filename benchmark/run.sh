@@ -0,0 +1,63 @@
+#!/usr/bin/env bash
+
+################################################################################
+# Run a benchmark page in headless Chromium
+################################################################################
+#
+# Usage: bash run.sh PAGE [QUERY] [-- INSTALLER_ARGS]
+#
+# Builds the payload with payload.sh (passing on INSTALLER_ARGS, e.g.,
+# --local MathJax-2.7.4.zip to run without internet access), opens
+# PAGE.html?QUERY in headless Chromium and prints the JSON results that
+# the page logs to the console.
+#
+################################################################################
+
+BENCHMARK_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+error() {
+	echo "$1"
+	exit 1
+}
+
+PAGE="$1"
+[[ -n "$PAGE" && -e "$BENCHMARK_DIR/$PAGE.html" ]] || error "Usage: bash run.sh PAGE [QUERY] [-- INSTALLER_ARGS]"
+shift
+QUERY=""
+if [[ -n "$1" && "$1" != "--" ]]; then
+	QUERY="$1"
+	shift
+fi
+[[ "$1" == "--" ]] && shift
+
+CHROMIUM=""
+for candidate in "$CHROMIUM_BIN" chromium chromium-browser google-chrome; do
+	if [[ -n "$candidate" ]] && command -v "$candidate" > /dev/null; then
+		CHROMIUM="$candidate"
+		break
+	fi
+done
+[[ -n "$CHROMIUM" ]] || error "Cannot find Chromium; set CHROMIUM_BIN to its path."
+
+bash "$BENCHMARK_DIR/payload.sh" "$@" > /dev/null || exit 1
+
+LOG_FILE="$BENCHMARK_DIR/build/chromium.log"
+"$CHROMIUM" --headless --disable-gpu --allow-file-access-from-files \
+	--enable-logging=stderr --v=0 --remote-debugging-port=0 \
+	"file://$BENCHMARK_DIR/$PAGE.html?$QUERY" 2> "$LOG_FILE" &
+CHROMIUM_PID=$!
+
+# The page logs a single line of JSON when it is done
+RESULT=""
+for (( i = 0; i < ${BENCHMARK_TIMEOUT:-600}; i++ )); do
+	RESULT="$(grep -o '{"benchmark":.*}' "$LOG_FILE" | head -n 1)"
+	[[ -n "$RESULT" ]] && break
+	kill -0 "$CHROMIUM_PID" 2> /dev/null || break
+	sleep 1
+done
+
+kill "$CHROMIUM_PID" 2> /dev/null
+wait "$CHROMIUM_PID" 2> /dev/null
+
+[[ -n "$RESULT" ]] || error "No results; see $LOG_FILE."
+echo "$RESULT"
@@ -0,0 +1,97 @@
+// Throughput of math-with-slack's tokenizer against MathJax 2's tex2jax
+// preprocessor: both mark up the math in the same synthetic channel as
+// math/tex scripts, and the time this takes is reported in messages per
+// second. Options are read from the query string: messages (per round),
+// rounds, density and seed (see messages.js) and mathjax (the URL of
+// MathJax.js).
+
+var params = new URLSearchParams(window.location.search);
+var options = {
+  messages: Number(params.get('messages') || 2000),
+  rounds: Number(params.get('rounds') || 5),
+  density: Number(params.get('density') || 0.3),
+  seed: Number(params.get('seed') || 1),
+  mathjax: params.get('mathjax') || 'build/mathjax/MathJax.js'
+};
+var mathjax_cdn_url = 'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJax.js';
+
+function build_channel(container, count) {
+  container.textContent = '';
+  container.appendChild(make_channel(count, generator(options.seed, options.density)));
+}
+
+function count_scripts(container) {
+  return Array.prototype.filter.call(container.getElementsByTagName('script'), function (script) {
+    return script.type.indexOf('math/tex') === 0;
+  }).length;
+}
+
+function summary(times, equations) {
+  var ms = times.reduce(function (a, b) { return a + b; }, 0) / times.length;
+  return {
+    ms: Math.round(ms * 100) / 100,
+    messages_per_second: Math.round(options.messages / ms * 1000),
+    equations: equations
+  };
+}
+
+function run() {
+  var container = document.getElementById('messages');
+  var tokenizer = [];
+  var tex2jax = [];
+  var equations = { tokenizer: 0, tex2jax: 0 };
+  for (var round = 0; round < options.rounds; round++) {
+    build_channel(container, options.messages);
+    var start = performance.now();
+    equations.tokenizer = window.mathWithSlack.tokenize(container);
+    tokenizer.push(performance.now() - start);
+
+    build_channel(container, options.messages);
+    start = performance.now();
+    MathJax.Extension.tex2jax.PreProcess(container);
+    tex2jax.push(performance.now() - start);
+    equations.tex2jax = count_scripts(container);
+  }
+  var results = {
+    benchmark: 'tokenizer',
+    date: new Date().toISOString(),
+    corpus: corpus.version,
+    options: options,
+    expected: expected_equations(container),
+    tokenizer: summary(tokenizer, equations.tokenizer),
+    tex2jax: summary(tex2jax, equations.tex2jax)
+  };
+  document.getElementById('results').textContent = JSON.stringify(results, null, 2);
+  console.log(JSON.stringify(results));
+  document.title = 'done';
+}
+
+function load_mathjax(url, fallback_url) {
+  window.MathJax = {
+    skipStartupTypeset: true,
+    messageStyle: 'none',
+    extensions: ['tex2jax.js'],
+    jax: ['input/TeX'],
+    tex2jax: {
+      displayMath: [['$$', '$$']],
+      inlineMath: [['$', '$']],
+      processEscapes: true,
+      preview: 'none'
+    },
+    AuthorInit: function () {
+      MathJax.Hub.Register.StartupHook('End', run);
+    }
+  };
+  var script = document.createElement('script');
+  script.src = url;
+  script.onerror = function () {
+    if (fallback_url) {
+      load_mathjax(fallback_url, null);
+    }
+  };
+  document.head.appendChild(script);
+}
+
+window.addEventListener('load', function () {
+  load_mathjax(options.mathjax, mathjax_cdn_url);
+});
@@ -19,17 +19,122 @@
 :: Constants
 
 SET "MWS_VERSION=v0.2.5"
+SET "MATHJAX2_VERSION=2.7.4"
+SET "MATHJAX3_VERSION=3.2.2"
+SET "KATEX_VERSION=0.16.9"
+SET "KATEX_ARCHIVE_URL=https://github.com/KaTeX/KaTeX/releases/download/v%KATEX_VERSION%/katex.tar.gz"
+
+:: Components loaded by the MathJax configuration in the payload (and their
+:: dependencies), in the order they are combined into the local bundle
+SET MATHJAX_COMPONENTS=jax/input/TeX/config.js jax/output/HTML-CSS/config.js extensions/MathEvents.js jax/element/mml/jax.js extensions/TeX/noErrors.js extensions/TeX/noUndefined.js jax/input/TeX/jax.js extensions/TeX/AMSmath.js extensions/TeX/AMSsymbols.js jax/output/HTML-CSS/jax.js
 
 
 :: User input
 
 SET "UNINSTALL="
 SET "SLACK_DIR="
+SET "LOCAL="
+SET "MATHJAX_ARCHIVE="
+SET "KATEX_ARCHIVE="
+SET "ENGINE=mathjax2"
+SET "LAZY_MARGIN=null"
+SET "CACHE_SIZE=4"
+SET "WORKER=false"
+SET "WORKER_COUNT=0"
+SET "CHUNK_BUDGET=8"
+SET "MAX_LENGTH=2000"
+SET "MAX_DEPTH=40"
+SET "MAX_MACROS=10000"
+SET "TIMEOUT=1000"
+SET "TIMELINE_LOG="
 
 :parse
 IF "%~1" == "" GOTO endparse
 IF "%~1" == "-u" (
 	SET UNINSTALL=%~1
+) ELSE IF "%~1" == "--lazy" (
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9][0-9]*$" >NUL || (
+		ECHO --lazy expects a margin in pixels, e.g., --lazy 800
+		PAUSE & EXIT /B 1
+	)
+	SET "LAZY_MARGIN='%~2px'"
+	SHIFT
+) ELSE IF "%~1" == "--engine" (
+	IF NOT "%~2" == "mathjax2" IF NOT "%~2" == "mathjax3" IF NOT "%~2" == "katex" (
+		ECHO --engine expects mathjax2, mathjax3 or katex
+		PAUSE & EXIT /B 1
+	)
+	SET "ENGINE=%~2"
+	SHIFT
+	IF "%~2" == "katex" IF EXIST "%~3" IF NOT EXIST "%~3\*" (
+		SET "KATEX_ARCHIVE=%~3"
+		SHIFT
+	)
+) ELSE IF "%~1" == "--local" (
+	SET "LOCAL=%~1"
+	IF EXIST "%~2" IF NOT EXIST "%~2\*" (
+		SET "MATHJAX_ARCHIVE=%~2"
+		SHIFT
+	)
+) ELSE IF "%~1" == "--worker" (
+	SET "WORKER=true"
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9][0-9]*$" >NUL && (
+		SET "WORKER_COUNT=%~2"
+		SHIFT
+	)
+) ELSE IF "%~1" == "--chunk-budget" (
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9][0-9]*$" >NUL || (
+		ECHO --chunk-budget expects a time in milliseconds, e.g., --chunk-budget 8
+		PAUSE & EXIT /B 1
+	)
+	SET "CHUNK_BUDGET=%~2"
+	SHIFT
+) ELSE IF "%~1" == "--max-length" (
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9][0-9]*$" >NUL || (
+		ECHO --max-length expects a number of characters, e.g., --max-length 2000
+		PAUSE & EXIT /B 1
+	)
+	SET "MAX_LENGTH=%~2"
+	SHIFT
+) ELSE IF "%~1" == "--max-depth" (
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9][0-9]*$" >NUL || (
+		ECHO --max-depth expects a nesting depth, e.g., --max-depth 40
+		PAUSE & EXIT /B 1
+	)
+	SET "MAX_DEPTH=%~2"
+	SHIFT
+) ELSE IF "%~1" == "--max-macros" (
+	ECHO.%~2| FINDSTR /R "^[1-9][0-9]*$" >NUL || (
+		ECHO --max-macros expects a number of macro expansions, e.g., --max-macros 10000
+		PAUSE & EXIT /B 1
+	)
+	SET "MAX_MACROS=%~2"
+	SHIFT
+) ELSE IF "%~1" == "--timeout" (
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9][0-9]*$" >NUL || (
+		ECHO --timeout expects a time in milliseconds, e.g., --timeout 1000; it does not apply to MathJax 2
+		PAUSE & EXIT /B 1
+	)
+	SET "TIMEOUT=%~2"
+	SHIFT
+) ELSE IF "%~1" == "--cache-size" (
+	ECHO.%~2| FINDSTR /R "^0$ ^[1-9]$ ^[1-9][0-9]$ ^[1-9][0-9][0-9]$ ^[1-9][0-9][0-9][0-9]$" >NUL || (
+		ECHO --cache-size expects a size in megabytes, at most 1024, e.g., --cache-size 4
+		PAUSE & EXIT /B 1
+	)
+	IF %~2 GTR 1024 (
+		ECHO --cache-size expects a size in megabytes, at most 1024, e.g., --cache-size 4
+		PAUSE & EXIT /B 1
+	)
+	SET "CACHE_SIZE=%~2"
+	SHIFT
+) ELSE IF "%~1" == "--timeline-log" (
+	IF "%~2" == "" (
+		ECHO --timeline-log expects a file, e.g., --timeline-log %%USERPROFILE%%\mws-timeline.log
+		PAUSE & EXIT /B 1
+	)
+	FOR %%F IN ("%~2") DO SET "TIMELINE_LOG=%%~fF"
+	SHIFT
 ) ELSE (
 	SET SLACK_DIR=%~1
 )
@@ -37,6 +142,29 @@ SHIFT
 GOTO parse
 :endparse
 
+IF "%WORKER%" == "true" IF NOT "%ENGINE%" == "mathjax3" (
+	ECHO --worker requires --engine mathjax3
+	PAUSE & EXIT /B 1
+)
+
+
+:: Engine settings
+
+:: KaTeX falls back on MathJax 2 for equations it cannot render
+IF "%ENGINE%" == "mathjax3" (
+	SET "MATHJAX_VERSION=%MATHJAX3_VERSION%"
+	SET "MATHJAX_CDN_URL=https://cdnjs.cloudflare.com/ajax/libs/mathjax/%MATHJAX3_VERSION%/es5/tex-chtml.js"
+	SET "MATHJAX_ARCHIVE_URL=https://registry.npmjs.org/mathjax/-/mathjax-%MATHJAX3_VERSION%.tgz"
+	SET "MATHJAX_ARCHIVE_DIR=package\es5"
+	SET "MATHJAX_MAIN=tex-chtml.js"
+) ELSE (
+	SET "MATHJAX_VERSION=%MATHJAX2_VERSION%"
+	SET "MATHJAX_CDN_URL=https://cdnjs.cloudflare.com/ajax/libs/mathjax/%MATHJAX2_VERSION%/MathJax.js"
+	SET "MATHJAX_ARCHIVE_URL=https://github.com/mathjax/MathJax/archive/%MATHJAX2_VERSION%.zip"
+	SET "MATHJAX_ARCHIVE_DIR=MathJax-%MATHJAX2_VERSION%"
+	SET "MATHJAX_MAIN=MathJax.js"
+)
+
 
 :: Try to find slack if not provided by user
 
@@ -51,6 +179,8 @@ IF "%SLACK_DIR%" == "" (
 
 SET "SLACK_MATHJAX_SCRIPT=%SLACK_DIR%\math-with-slack.js"
 SET "SLACK_SSB_INTEROP=%SLACK_DIR%\ssb-interop.js"
+SET "SLACK_MATHJAX_DIR=%SLACK_DIR%\mathjax"
+SET "SLACK_KATEX_DIR=%SLACK_DIR%\katex"
 
 
 :: Check so installation exists
@@ -80,6 +210,14 @@ IF EXIST "%SLACK_MATHJAX_SCRIPT%" (
 	DEL "%SLACK_MATHJAX_SCRIPT%"
 )
 
+IF EXIST "%SLACK_MATHJAX_DIR%" (
+	RMDIR /S /Q "%SLACK_MATHJAX_DIR%"
+)
+
+IF EXIST "%SLACK_KATEX_DIR%" (
+	RMDIR /S /Q "%SLACK_KATEX_DIR%"
+)
+
 
 :: Restore previous injections
 
@@ -106,51 +244,1551 @@ IF "%UNINSTALL%" == "-u" (
 )
 
 
+:: Install MathJax locally
+
+SET "MATHJAX_URL=%MATHJAX_CDN_URL%"
+SET "MATHJAX_BUNDLED=false"
+IF "%LOCAL%" == "" GOTO endlocal
+
+SET "MATHJAX_TMP=%TEMP%\math-with-slack-%RANDOM%"
+MKDIR "%MATHJAX_TMP%"
+IF NOT "%MATHJAX_ARCHIVE%" == "" GOTO unpacklocal
+ECHO Downloading MathJax %MATHJAX_VERSION% from: %MATHJAX_ARCHIVE_URL%
+FOR %%a IN ("%MATHJAX_ARCHIVE_URL%") DO SET "MATHJAX_ARCHIVE=%MATHJAX_TMP%\%%~nxa"
+curl -sSfL -o "%MATHJAX_ARCHIVE%" "%MATHJAX_ARCHIVE_URL%" || (
+	ECHO Cannot download MathJax.
+	PAUSE & EXIT /B 1
+)
+
+:unpacklocal
+tar -xf "%MATHJAX_ARCHIVE%" -C "%MATHJAX_TMP%" || (
+	ECHO Cannot unpack MathJax archive: %MATHJAX_ARCHIVE%
+	PAUSE & EXIT /B 1
+)
+IF NOT EXIST "%MATHJAX_TMP%\%MATHJAX_ARCHIVE_DIR%\%MATHJAX_MAIN%" (
+	ECHO Archive does not contain MathJax %MATHJAX_VERSION%: %MATHJAX_ARCHIVE%
+	PAUSE & EXIT /B 1
+)
+MOVE /Y "%MATHJAX_TMP%\%MATHJAX_ARCHIVE_DIR%" "%SLACK_MATHJAX_DIR%" >NUL
+RMDIR /S /Q "%MATHJAX_TMP%"
+ECHO Installed MathJax %MATHJAX_VERSION% at: %SLACK_MATHJAX_DIR%
+SET "MATHJAX_URL=file:///%SLACK_MATHJAX_DIR:\=/%/%MATHJAX_MAIN%"
+IF "%ENGINE%" == "mathjax3" GOTO endlocal
+
+:: Drop what the payload never loads (sources, docs and image fonts)
+FOR %%d IN (docs test unpacked fonts\HTML-CSS\TeX\png) DO (
+	IF EXIST "%SLACK_MATHJAX_DIR%\%%d" RMDIR /S /Q "%SLACK_MATHJAX_DIR%\%%d"
+)
+
+:: Combine MathJax and the configured components into one file, so that
+:: startup reads a single file instead of requesting each component
+SET "MATHJAX_BUNDLE=%SLACK_MATHJAX_DIR%\MathJax-bundle.js"
+SET "PRELOADING="
+SET "BUNDLE_FILES=1"
+FOR %%c IN (%MATHJAX_COMPONENTS%) DO CALL :preload_component %%c || (
+	PAUSE & EXIT /B 1
+)
+COPY /B "%SLACK_MATHJAX_DIR%\MathJax.js" "%MATHJAX_BUNDLE%" >NUL
+>>"%MATHJAX_BUNDLE%" ECHO.
+>>"%MATHJAX_BUNDLE%" ECHO.MathJax.Ajax.Preloading(%PRELOADING:~2%);
+FOR %%c IN (%MATHJAX_COMPONENTS%) DO CALL :bundle_component %%c
+FOR %%f IN ("%MATHJAX_BUNDLE%") DO SET /A "BUNDLE_KB=%%~zf / 1024"
+ECHO Combined %BUNDLE_FILES% MathJax files into a %BUNDLE_KB% KB bundle.
+SET "MATHJAX_URL=file:///%MATHJAX_BUNDLE:\=/%"
+SET "MATHJAX_BUNDLED=true"
+
+:endlocal
+
+
+:: Install KaTeX
+
+SET "KATEX_URL="
+IF NOT "%ENGINE%" == "katex" GOTO endkatex
+
+SET "KATEX_TMP=%TEMP%\math-with-slack-%RANDOM%"
+MKDIR "%KATEX_TMP%"
+IF NOT "%KATEX_ARCHIVE%" == "" GOTO unpackkatex
+ECHO Downloading KaTeX %KATEX_VERSION% from: %KATEX_ARCHIVE_URL%
+SET "KATEX_ARCHIVE=%KATEX_TMP%\katex.tar.gz"
+curl -sSfL -o "%KATEX_ARCHIVE%" "%KATEX_ARCHIVE_URL%" || (
+	ECHO Cannot download KaTeX.
+	PAUSE & EXIT /B 1
+)
+
+:unpackkatex
+tar -xf "%KATEX_ARCHIVE%" -C "%KATEX_TMP%" || (
+	ECHO Cannot unpack KaTeX archive: %KATEX_ARCHIVE%
+	PAUSE & EXIT /B 1
+)
+IF NOT EXIST "%KATEX_TMP%\katex\katex.min.js" (
+	ECHO Archive does not contain KaTeX: %KATEX_ARCHIVE%
+	PAUSE & EXIT /B 1
+)
+MOVE /Y "%KATEX_TMP%\katex" "%SLACK_KATEX_DIR%" >NUL
+RMDIR /S /Q "%KATEX_TMP%"
+SET "KATEX_URL=file:///%SLACK_KATEX_DIR:\=/%"
+ECHO Installed KaTeX %KATEX_VERSION% at: %SLACK_KATEX_DIR%
+
+:endkatex
+
+
 :: Write main script
 
+SET /A "CACHE_BYTES=CACHE_SIZE * 1024 * 1024"
+
+:: Escape the path of the timeline log for a JavaScript string
+SET "TIMELINE_LOG_JS="
+IF DEFINED TIMELINE_LOG SET "TIMELINE_LOG_JS=%TIMELINE_LOG:\=/%"
+IF DEFINED TIMELINE_LOG_JS SET "TIMELINE_LOG_JS=%TIMELINE_LOG_JS:'=\'%"
+
 >"%SLACK_MATHJAX_SCRIPT%" (
 	ECHO.// math-with-slack %MWS_VERSION%
 	ECHO.// https://github.com/fsavje/math-with-slack
+	ECHO.
+	ECHO.var mws_version = '%MWS_VERSION%';
+	ECHO.var mws_engine = '%ENGINE%';
+	ECHO.var mws_mathjax_url = '%MATHJAX_URL%';
+	ECHO.var mws_mathjax_bundled = %MATHJAX_BUNDLED%;
+	ECHO.var mws_katex_url = '%KATEX_URL%';
+	ECHO.var mws_worker = %WORKER%;
+	ECHO.var mws_worker_count = %WORKER_COUNT%;
+	ECHO.var mws_lazy_margin = %LAZY_MARGIN%;
+	ECHO.var mws_chunk_budget = %CHUNK_BUDGET%;
+	ECHO.var mws_max_length = %MAX_LENGTH%;
+	ECHO.var mws_max_depth = %MAX_DEPTH%;
+	ECHO.var mws_max_macros = %MAX_MACROS%;
+	ECHO.var mws_timeout = %TIMEOUT%;
+	ECHO.var mws_cache_size = %CACHE_BYTES%;
+	ECHO.var mws_timeline_log = '%TIMELINE_LOG_JS%';
+)
+
+>>"%SLACK_MATHJAX_SCRIPT%" (
 	ECHO.
 	ECHO.document.addEventListener('DOMContentLoaded', function(^) {
-	ECHO.  var mathjax_config = document.createElement('script'^);
-	ECHO.  mathjax_config.type = 'text/x-mathjax-config';
-	ECHO.  mathjax_config.text = `
-	ECHO.    MathJax.Hub.Config({
-	ECHO.      messageStyle: 'none',
-	ECHO.      extensions: ['tex2jax.js'],
-	ECHO.      jax: ['input/TeX', 'output/HTML-CSS'],
-	ECHO.      tex2jax: {
-	ECHO.        displayMath: [['\$\$', '\$\$']],
-	ECHO.        element: 'msgs_div',
-	ECHO.        ignoreClass: 'ql-editor',
-	ECHO.        inlineMath: [['\$', '\$']],
-	ECHO.        processEscapes: true,
-	ECHO.        skipTags: ['script', 'noscript', 'style', 'textarea', 'pre', 'code']
-	ECHO.      },
-	ECHO.      TeX: {
-	ECHO.        extensions: ['AMSmath.js', 'AMSsymbols.js', 'noErrors.js', 'noUndefined.js']
+	ECHO.  timeline_mark('dom-ready'^);
+	ECHO.
+	ECHO.  // Nodes waiting to be typeset. Mutations only add to this set; the set is
+	ECHO.  // flushed at most once per idle period (or animation frame^), and never
+	ECHO.  // while a previous flush is still in MathJax's queue. Nothing is flushed
+	ECHO.  // before the engine has been loaded, which only happens once the first
+	ECHO.  // node with math is marked dirty. typesetting holds the nodes of the
+	ECHO.  // flush in progress.
+	ECHO.  var dirty_nodes = [];
+	ECHO.  var flush_requested = false;
+	ECHO.  var typesetting = null;
+	ECHO.  var engine_state = 'unloaded';
+	ECHO.
+	ECHO.  function mark_dirty(node^) {
+	ECHO.    if (!node ^|^| dirty_nodes.some(function (other^) { return other.contains(node^); }^)^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    dirty_nodes = dirty_nodes.filter(function (other^) { return !node.contains(other^); }^);
+	ECHO.    dirty_nodes.push(node^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function request_flush(^) {
+	ECHO.    if (engine_state !== 'ready'^) {
+	ECHO.      load_engine(^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    if (flush_requested ^|^| typesetting^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    flush_requested = true;
+	ECHO.    if (window.requestIdleCallback^) {
+	ECHO.      window.requestIdleCallback(flush, { timeout: 200 }^);
+	ECHO.    } else {
+	ECHO.      window.requestAnimationFrame(flush^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  // Dirty nodes are typeset in chunks, messages in view first and then the
+	ECHO.  // newest, so that a large backlog does not freeze the client. A chunk
+	ECHO.  // holds as many nodes as the engine is expected to get through within
+	ECHO.  // mws_chunk_budget milliseconds, judging by the time it took per node
+	ECHO.  // (until the engine was done with the chunk^) in earlier chunks. The rest
+	ECHO.  // wait for the next idle period. A budget of 0 typesets everything at
+	ECHO.  // once. Timers are coarse and cached equations are quick, so the time per
+	ECHO.  // node is taken to be at least chunk_min_ms, and a chunk never holds
+	ECHO.  // more than chunk_max_nodes nodes.
+	ECHO.  var chunk_stats = { chunks: 0, ms_per_node: 0 };
+	ECHO.  var chunk_min_ms = 0.1;
+	ECHO.  var chunk_max_nodes = 100;
+	ECHO.
+	ECHO.  function in_viewport(node^) {
+	ECHO.    var rect = node.getBoundingClientRect(^);
+	ECHO.    return rect.bottom ^> 0 ^&^& rect.top ^< window.innerHeight;
+	ECHO.  }
+	ECHO.
+	ECHO.  function by_priority(nodes^) {
+	ECHO.    var newest_first = function (a, b^) {
+	ECHO.      return a.compareDocumentPosition(b^) ^& Node.DOCUMENT_POSITION_FOLLOWING ? 1 : -1;
+	ECHO.    };
+	ECHO.    var visible = nodes.filter(in_viewport^);
+	ECHO.    var hidden = nodes.filter(function (node^) { return visible.indexOf(node^) === -1; }^);
+	ECHO.    return visible.sort(newest_first^).concat(hidden.sort(newest_first^)^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function chunk_size(count^) {
+	ECHO.    if (mws_chunk_budget === 0^) {
+	ECHO.      return count;
+	ECHO.    }
+	ECHO.    if (chunk_stats.chunks === 0^) {
+	ECHO.      return 1;
+	ECHO.    }
+	ECHO.    var ms_per_node = Math.max(chunk_min_ms, chunk_stats.ms_per_node^);
+	ECHO.    return Math.min(chunk_max_nodes, Math.max(1, Math.floor(mws_chunk_budget / ms_per_node^)^)^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function flush(^) {
+	ECHO.    if (engine_state !== 'ready'^) {
+	ECHO.      flush_requested = false;
+	ECHO.      load_engine(^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var root = document.getElementById('msgs_div'^) ^|^| document.body;
+	ECHO.    var nodes = by_priority(dirty_nodes.filter(function (node^) { return root.contains(node^); }^)^);
+	ECHO.    var chunk = nodes.slice(0, chunk_size(nodes.length^)^);
+	ECHO.    dirty_nodes = nodes.slice(chunk.length^);
+	ECHO.    flush_requested = false;
+	ECHO.    if (chunk.length === 0^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    typesetting = chunk;
+	ECHO.    var start = performance.now(^);
+	ECHO.    engine.typeset(chunk, function (^) {
+	ECHO.      var ms = performance.now(^) - start;
+	ECHO.      record_typeset(chunk.length, ms^);
+	ECHO.      chunk_stats.ms_per_node = chunk_stats.chunks === 0 ? ms / chunk.length : 0.8 * chunk_stats.ms_per_node + 0.2 * ms / chunk.length;
+	ECHO.      chunk_stats.chunks++;
+	ECHO.      chunk.forEach(mark_scanned^);
+	ECHO.      save_cache(^);
+	ECHO.      typesetting = null;
+	ECHO.      if (timeline_mark('first-typeset'^)^) {
+	ECHO.        write_timeline(^);
+	ECHO.      }
+	ECHO.      if (dirty_nodes.length ^> 0^) {
+	ECHO.        request_flush(^);
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Counters for mathWithSlack.stats(^) and the overlay. A typeset's render
+	ECHO.  // time runs from the start of the chunk until the engine is done with it,
+	ECHO.  // including any time spent waiting for MathJax's queue or the workers.
+	ECHO.  // The last 500 render times are kept for the percentile.
+	ECHO.  var typeset_stats = { typesets: 0, nodes: 0, equations: 0, total_ms: 0, times: [] };
+	ECHO.
+	ECHO.  function record_typeset(nodes, ms^) {
+	ECHO.    typeset_stats.typesets++;
+	ECHO.    typeset_stats.nodes += nodes;
+	ECHO.    typeset_stats.total_ms += ms;
+	ECHO.    typeset_stats.times.push(ms^);
+	ECHO.    if (typeset_stats.times.length ^> 500^) {
+	ECHO.      typeset_stats.times.shift(^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  function percentile(values, p^) {
+	ECHO.    if (values.length === 0^) {
+	ECHO.      return 0;
+	ECHO.    }
+	ECHO.    var sorted = values.slice(^).sort(function (a, b^) { return a - b; }^);
+	ECHO.    return sorted[Math.ceil(p * sorted.length^) - 1];
+	ECHO.  }
+	ECHO.
+	ECHO.  function queue_depth(^) {
+	ECHO.    return dirty_nodes.length + (typesetting ? typesetting.length : 0^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function stats(^) {
+	ECHO.    return {
+	ECHO.      engine: engine_state === 'ready' ? engine.version(^) : null,
+	ECHO.      typesets: typeset_stats.typesets,
+	ECHO.      nodes_scanned: filter_stats.checked,
+	ECHO.      nodes_typeset: typeset_stats.nodes,
+	ECHO.      equations: typeset_stats.equations,
+	ECHO.      cache_hits: render_cache.hits,
+	ECHO.      render_ms: Math.round(typeset_stats.total_ms^),
+	ECHO.      render_ms_p95: Math.round(percentile(typeset_stats.times, 0.95^)^),
+	ECHO.      queue: queue_depth(^),
+	ECHO.      worker_queue: worker_pool.queue.length
+	ECHO.    };
+	ECHO.  }
+	ECHO.
+	ECHO.  // Debug overlay with the counters, toggled with Ctrl+Alt+M. It lives
+	ECHO.  // outside the message list, so its updates are not seen by the observer.
+	ECHO.  var overlay = null;
+	ECHO.
+	ECHO.  function toggle_overlay(^) {
+	ECHO.    if (overlay^) {
+	ECHO.      window.clearInterval(overlay.timer^);
+	ECHO.      overlay.node.remove(^);
+	ECHO.      overlay = null;
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var node = document.createElement('pre'^);
+	ECHO.    node.className = 'mws-overlay';
+	ECHO.    node.style.cssText = 'position: fixed; right: 8px; bottom: 8px; z-index: 10000; margin: 0; padding: 6px 8px; ' +
+	ECHO.      'background: rgba(0, 0, 0, 0.75^); color: #fff; font: 11px monospace; pointer-events: none;';
+	ECHO.    function update(^) {
+	ECHO.      var current = stats(^);
+	ECHO.      node.textContent = Object.keys(current^).map(function (name^) { return name + ': ' + current[name]; }^).join('\n'^);
+	ECHO.    }
+	ECHO.    update(^);
+	ECHO.    document.body.appendChild(node^);
+	ECHO.    overlay = { node: node, timer: window.setInterval(update, 500^) };
+	ECHO.  }
+	ECHO.
+	ECHO.  document.addEventListener('keydown', function (event^) {
+	ECHO.    // AltGr is reported as Ctrl+Alt on Windows, and AltGr+M types a character
+	ECHO.    // on some layouts
+	ECHO.    if (event.ctrlKey ^&^& event.altKey ^&^& event.code === 'KeyM' ^&^& !event.getModifierState('AltGraph'^)^) {
+	ECHO.      event.preventDefault(^);
+	ECHO.      toggle_overlay(^);
+	ECHO.    }
+	ECHO.  }^);
+	ECHO.
+	ECHO.  // Rendered equations keyed by TeX source, display mode and font size, in
+	ECHO.  // least recently used order. Cached output is cloned into new messages
+	ECHO.  // instead of running the TeX input jax again. Sizes are estimated from the
+	ECHO.  // length of the output's markup.
+	ECHO.  var render_cache = { entries: new Map(^), bytes: 0, hits: 0, misses: 0 };
+	ECHO.
+	ECHO.  function cache_get(key^) {
+	ECHO.    var entry = render_cache.entries.get(key^);
+	ECHO.    if (!entry^) {
+	ECHO.      render_cache.misses++;
+	ECHO.      return null;
+	ECHO.    }
+	ECHO.    if (!entry.node^) {
+	ECHO.      var template = document.createElement('template'^);
+	ECHO.      template.innerHTML = entry.html;
+	ECHO.      entry.node = template.content.firstChild;
+	ECHO.    }
+	ECHO.    entry.time = Date.now(^);
+	ECHO.    render_cache.entries.delete(key^);
+	ECHO.    render_cache.entries.set(key, entry^);
+	ECHO.    render_cache.hits++;
+	ECHO.    queue_write(key, entry^);
+	ECHO.    return entry;
+	ECHO.  }
+	ECHO.
+	ECHO.  function cache_insert(key, entry^) {
+	ECHO.    if (entry.bytes ^> mws_cache_size^) {
+	ECHO.      return false;
+	ECHO.    }
+	ECHO.    if (render_cache.entries.has(key^)^) {
+	ECHO.      render_cache.bytes -= render_cache.entries.get(key^).bytes;
+	ECHO.      render_cache.entries.delete(key^);
+	ECHO.    }
+	ECHO.    render_cache.entries.set(key, entry^);
+	ECHO.    render_cache.bytes += entry.bytes;
+	ECHO.    while (render_cache.bytes ^> mws_cache_size^) {
+	ECHO.      var oldest = render_cache.entries.keys(^).next(^).value;
+	ECHO.      render_cache.bytes -= render_cache.entries.get(oldest^).bytes;
+	ECHO.      render_cache.entries.delete(oldest^);
+	ECHO.      queue_write(oldest, null^);
+	ECHO.    }
+	ECHO.    return true;
+	ECHO.  }
+	ECHO.
+	ECHO.  function detached_copy(output^) {
+	ECHO.    var node = output.cloneNode(true^);
+	ECHO.    node.removeAttribute('id'^);
+	ECHO.    Array.prototype.forEach.call(node.querySelectorAll('[id]'^), function (el^) {
+	ECHO.      el.removeAttribute('id'^);
+	ECHO.    }^);
+	ECHO.    return node;
+	ECHO.  }
+	ECHO.
+	ECHO.  function cache_put(key, output^) {
+	ECHO.    var node = detached_copy(output^);
+	ECHO.    var html = node.outerHTML;
+	ECHO.    var entry = { node: node, html: html, bytes: 2 * html.length, time: Date.now(^) };
+	ECHO.    if (cache_insert(key, entry^)^) {
+	ECHO.      queue_write(key, entry^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  // The equations of each message as they were last rendered, by cache key.
+	ECHO.  // When a message is edited, its new equations are compared with these and
+	ECHO.  // only the ones that changed are rendered; the rest are reused from here,
+	ECHO.  // even if the render cache is off or has dropped them. Messages that Slack
+	ECHO.  // discards take their equations with them.
+	ECHO.  var message_equations = new WeakMap(^);
+	ECHO.  var edit_stats = { reused: 0 };
+	ECHO.
+	ECHO.  function record_output(node, key, output^) {
+	ECHO.    var message = message_of(node^);
+	ECHO.    if (!message^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    if (!message_equations.has(message^)^) {
+	ECHO.      message_equations.set(message, new Map(^)^);
+	ECHO.    }
+	ECHO.    message_equations.get(message^).set(key, detached_copy(output^)^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Output for the equation with key in node that needs no rendering, from
+	ECHO.  // the message's previous rendering or from the render cache.
+	ECHO.  function known_output(node, key^) {
+	ECHO.    var message = message_of(node^);
+	ECHO.    var equations = message ^&^& message_equations.get(message^);
+	ECHO.    if (equations ^&^& equations.has(key^)^) {
+	ECHO.      edit_stats.reused++;
+	ECHO.      return equations.get(key^).cloneNode(true^);
+	ECHO.    }
+	ECHO.    var entry = cache_get(key^);
+	ECHO.    if (!entry^) {
+	ECHO.      return null;
+	ECHO.    }
+	ECHO.    record_output(node, key, entry.node^);
+	ECHO.    return entry.node.cloneNode(true^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // The render cache is also kept in IndexedDB so that it survives restarts.
+	ECHO.  // Stored equations are dropped when math-with-slack or MathJax is updated
+	ECHO.  // and when they have not been used for cache_max_age; the rest are loaded
+	ECHO.  // oldest first, so the size limit evicts the least recently used ones.
+	ECHO.  var cache_max_age = 30 * 24 * 60 * 60 * 1000;
+	ECHO.  var cache_db = null;
+	ECHO.  var cache_writes = new Map(^);
+	ECHO.
+	ECHO.  // Changes are only queued while there is a database to write them to
+	ECHO.  function queue_write(key, entry^) {
+	ECHO.    if (cache_db^) {
+	ECHO.      cache_writes.set(key, entry^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  function load_cache(callback^) {
+	ECHO.    if (mws_cache_size === 0 ^|^| !window.indexedDB^) {
+	ECHO.      callback(^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var version = mws_version + '/' + engine.version(^);
+	ECHO.    var request = window.indexedDB.open('math-with-slack', 1^);
+	ECHO.    request.onupgradeneeded = function (^) {
+	ECHO.      request.result.createObjectStore('meta'^);
+	ECHO.      request.result.createObjectStore('equations'^);
+	ECHO.    };
+	ECHO.    request.onerror = function (^) { callback(^); };
+	ECHO.    request.onsuccess = function (^) {
+	ECHO.      var db = request.result;
+	ECHO.      var stored = [];
+	ECHO.      var stored_bad = [];
+	ECHO.      var tx = db.transaction(['meta', 'equations'], 'readwrite'^);
+	ECHO.      var equations = tx.objectStore('equations'^);
+	ECHO.      tx.objectStore('meta'^).get('version'^).onsuccess = function (event^) {
+	ECHO.        if (event.target.result !== version^) {
+	ECHO.          equations.clear(^);
+	ECHO.          tx.objectStore('meta'^).delete('bad_tex'^);
+	ECHO.          tx.objectStore('meta'^).put(version, 'version'^);
+	ECHO.          return;
+	ECHO.        }
+	ECHO.        tx.objectStore('meta'^).get('bad_tex'^).onsuccess = function (event^) {
+	ECHO.          stored_bad = event.target.result ^|^| [];
+	ECHO.        };
+	ECHO.        equations.openCursor(^).onsuccess = function (event^) {
+	ECHO.          var cursor = event.target.result;
+	ECHO.          if (!cursor^) {
+	ECHO.            return;
+	ECHO.          }
+	ECHO.          if (Date.now(^) - cursor.value.time ^> cache_max_age^) {
+	ECHO.            cursor.delete(^);
+	ECHO.          } else {
+	ECHO.            stored.push({ key: cursor.key, value: cursor.value }^);
+	ECHO.          }
+	ECHO.          cursor.continue(^);
+	ECHO.        };
+	ECHO.      };
+	ECHO.      tx.oncomplete = function (^) {
+	ECHO.        cache_db = db;
+	ECHO.        stored.sort(function (a, b^) { return a.value.time - b.value.time; }^);
+	ECHO.        stored.forEach(function (item^) {
+	ECHO.          var html = item.value.html;
+	ECHO.          cache_insert(item.key, { node: null, html: html, bytes: 2 * html.length, time: item.value.time }^);
+	ECHO.        }^);
+	ECHO.        bad_tex.hashes = new Set(stored_bad.concat(Array.from(bad_tex.hashes^)^)^);
+	ECHO.        save_cache(^);
+	ECHO.        callback(^);
+	ECHO.      };
+	ECHO.      tx.onabort = function (^) { callback(^); };
+	ECHO.    };
+	ECHO.  }
+	ECHO.
+	ECHO.  function save_cache(^) {
+	ECHO.    if (!cache_db^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    if (bad_tex.changed^) {
+	ECHO.      cache_db.transaction('meta', 'readwrite'^).objectStore('meta'^).put(Array.from(bad_tex.hashes^), 'bad_tex'^);
+	ECHO.      bad_tex.changed = false;
+	ECHO.    }
+	ECHO.    if (cache_writes.size === 0^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var equations = cache_db.transaction('equations', 'readwrite'^).objectStore('equations'^);
+	ECHO.    cache_writes.forEach(function (entry, key^) {
+	ECHO.      if (entry^) {
+	ECHO.        equations.put({ html: entry.html, time: entry.time }, key^);
+	ECHO.      } else {
+	ECHO.        equations.delete(key^);
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.    cache_writes.clear(^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // TeX that failed to parse, by a hash of its source and display mode. Such
+	ECHO.  // equations are shown as raw TeX when they show up again instead of being
+	ECHO.  // parsed once more, which matters for messages full of dollar signs that
+	ECHO.  // are not math. The most recent bad_tex.limit hashes are kept, and stored
+	ECHO.  // with the render cache; like the cache, they are dropped when
+	ECHO.  // math-with-slack or the engine changes.
+	ECHO.  var bad_tex = { hashes: new Set(^), limit: 1000, changed: false };
+	ECHO.
+	ECHO.  function bad_tex_hash(tex, display^) {
+	ECHO.    return text_hash((display ? '$$' : '$'^) + tex^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function is_bad_tex(tex, display^) {
+	ECHO.    return bad_tex.hashes.has(bad_tex_hash(tex, display^)^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function add_bad_tex(tex, display^) {
+	ECHO.    var hash = bad_tex_hash(tex, display^);
+	ECHO.    bad_tex.hashes.delete(hash^);
+	ECHO.    bad_tex.hashes.add(hash^);
+	ECHO.    if (bad_tex.hashes.size ^> bad_tex.limit^) {
+	ECHO.      bad_tex.hashes.delete(bad_tex.hashes.values(^).next(^).value^);
+	ECHO.    }
+	ECHO.    bad_tex.changed = true;
+	ECHO.  }
+	ECHO.
+	ECHO.  // MathJax 2 is handed the math as math/tex scripts, which is what tex2jax
+	ECHO.  // would have made of it. Equations found in the cache get their output
+	ECHO.  // instead, and equations over the limits or known to be bad TeX their raw
+	ECHO.  // TeX. The scripts are remembered so that their output can be cached once
+	ECHO.  // MathJax has rendered them, unless it turns out they could not be parsed.
+	ECHO.  function math_script(segment^) {
+	ECHO.    var script = document.createElement('script'^);
+	ECHO.    script.type = segment.display ? 'math/tex; mode=display' : 'math/tex';
+	ECHO.    script.text = segment.tex;
+	ECHO.    return script;
+	ECHO.  }
+	ECHO.
+	ECHO.  function mathjax2_output(segment, node, pending^) {
+	ECHO.    var script = math_script(segment^);
+	ECHO.    var key = [script.type, window.getComputedStyle(node^).fontSize, segment.tex].join('\n'^);
+	ECHO.    var output = known_output(node, key^);
+	ECHO.    if (output^) {
+	ECHO.      return output;
+	ECHO.    }
+	ECHO.    if (too_complex(segment.tex^) ^|^| is_bad_tex(segment.tex, segment.display^)^) {
+	ECHO.      return raw_output(segment.source^);
+	ECHO.    }
+	ECHO.    pending.push({ script: script, key: key, display: segment.display }^);
+	ECHO.    return script;
+	ECHO.  }
+	ECHO.
+	ECHO.  function fill_cache(pending^) {
+	ECHO.    pending.forEach(function (item^) {
+	ECHO.      var jax = MathJax.Hub.getJaxFor(item.script^);
+	ECHO.      if (jax ^&^& jax.root ^&^& jax.root.texError^) {
+	ECHO.        add_bad_tex(jax.originalText, item.display^);
+	ECHO.        return;
+	ECHO.      }
+	ECHO.      var frame = jax ^&^& document.getElementById(jax.inputID + '-Frame'^);
+	ECHO.      if (frame^) {
+	ECHO.        var output = frame.parentNode.className === 'MathJax_Display' ? frame.parentNode : frame;
+	ECHO.        cache_put(item.key, output^);
+	ECHO.        record_output(item.script, item.key, output^);
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Cheap check run before a node is handed to the engine: most messages
+	ECHO.  // contain no unescaped dollar sign outside the skipped tags and classes,
+	ECHO.  // and those never need to be scanned. Messages with dollar signs are
+	ECHO.  // scanned for math the way scan_math(^) does it, so that messages that
+	ECHO.  // only mention prices never reach the engine either.
+	ECHO.  var skip_tags = ['script', 'noscript', 'style', 'textarea', 'pre', 'code'];
+	ECHO.  var ignore_classes = ['ql-editor', 'katex', 'MathJax', 'MathJax_Display', 'MathJax_Preview', 'mws-raw'];
+	ECHO.  var skip_selector = skip_tags.concat(ignore_classes.map(function (c^) { return '.' + c; }^)^).join(', '^);
+	ECHO.  var filter_stats = { checked: 0, rejected: 0, unchanged: 0, ignored: 0 };
+	ECHO.
+	ECHO.  function text_walker(node^) {
+	ECHO.    return document.createTreeWalker(node, NodeFilter.SHOW_ELEMENT ^| NodeFilter.SHOW_TEXT, {
+	ECHO.      acceptNode: function (n^) {
+	ECHO.        if (n.nodeType === Node.TEXT_NODE^) {
+	ECHO.          return NodeFilter.FILTER_ACCEPT;
+	ECHO.        }
+	ECHO.        return n.matches(skip_selector^) ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_SKIP;
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Slack shows the line breaks in a message as ^<br^> elements. As with
+	ECHO.  // tex2jax, math may run across them (and across comments^), so text is
+	ECHO.  // scanned in runs of adjacent text nodes, line breaks and comments, with
+	ECHO.  // each line break standing in for whitespace. A run ends at its last text
+	ECHO.  // node.
+	ECHO.  var line_break = '\u2028';
+	ECHO.
+	ECHO.  function joins_run(node^) {
+	ECHO.    return node.nodeType === Node.TEXT_NODE ^|^| node.nodeType === Node.COMMENT_NODE ^|^|
+	ECHO.      node.nodeName === 'BR' ^|^| node.nodeName === 'WBR';
+	ECHO.  }
+	ECHO.
+	ECHO.  function text_runs(node^) {
+	ECHO.    var runs = [];
+	ECHO.    var in_run = new Set(^);
+	ECHO.    var walker = text_walker(node^);
+	ECHO.    while (walker.nextNode(^)^) {
+	ECHO.      if (in_run.has(walker.currentNode^)^) {
+	ECHO.        continue;
+	ECHO.      }
+	ECHO.      var run = [];
+	ECHO.      var between = [];
+	ECHO.      for (var n = walker.currentNode; n ^&^& joins_run(n^); n = n.nextSibling^) {
+	ECHO.        between.push(n^);
+	ECHO.        if (n.nodeType === Node.TEXT_NODE^) {
+	ECHO.          in_run.add(n^);
+	ECHO.          run = run.concat(between^);
+	ECHO.          between = [];
+	ECHO.        }
+	ECHO.      }
+	ECHO.      runs.push({
+	ECHO.        nodes: run,
+	ECHO.        text: run.map(function (n^) {
+	ECHO.          return n.nodeType === Node.TEXT_NODE ? n.data : n.nodeName === 'BR' ? line_break : '';
+	ECHO.        }^).join(''^)
+	ECHO.      }^);
+	ECHO.    }
+	ECHO.    return runs;
+	ECHO.  }
+	ECHO.
+	ECHO.  // The math in a run, with its line breaks turned into newlines
+	ECHO.  function scan_run(run^) {
+	ECHO.    return scan_math(run.text^).map(function (segment^) {
+	ECHO.      if ('tex' in segment^) {
+	ECHO.        segment.tex = segment.tex.split(line_break^).join('\n'^);
+	ECHO.        segment.source = segment.source.split(line_break^).join('\n'^);
+	ECHO.      }
+	ECHO.      return segment;
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function has_math(node^) {
+	ECHO.    if (node.textContent.indexOf('$'^) === -1 ^|^| node.closest(skip_selector^)^) {
+	ECHO.      return false;
+	ECHO.    }
+	ECHO.    return text_runs(node^).some(function (run^) {
+	ECHO.      return scan_math(run.text^).some(function (segment^) { return 'tex' in segment; }^);
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Candidates are checked message by message. Once a message has been
+	ECHO.  // scanned (and typeset, if it had math^) it is tagged with a hash of its
+	ECHO.  // text, and it is not scanned again while its text hashes the same, however
+	ECHO.  // often Slack touches it.
+	ECHO.  var message_selector = 'ts-message, .c-virtual_list__item, .c-message';
+	ECHO.
+	ECHO.  // Messages nest (Slack's list items hold the message proper^), so the
+	ECHO.  // messages of a node are always the innermost ones at or around it. They
+	ECHO.  // are what gets tagged, typeset and keyed by, however Slack added them.
+	ECHO.  function messages_in(node^) {
+	ECHO.    var root = node.closest(message_selector^) ^|^| node;
+	ECHO.    var messages = Array.prototype.filter.call(root.querySelectorAll(message_selector^), function (m^) {
+	ECHO.      return m.querySelector(message_selector^) === null;
+	ECHO.    }^);
+	ECHO.    return messages.length ^> 0 ? messages : [root];
+	ECHO.  }
+	ECHO.
+	ECHO.  function message_of(node^) {
+	ECHO.    var messages = messages_in(node^);
+	ECHO.    return messages.length === 1 ^&^& messages[0].matches(message_selector^) ? messages[0] : null;
+	ECHO.  }
+	ECHO.
+	ECHO.  function text_hash(text^) {
+	ECHO.    var hash = 0x811c9dc5;
+	ECHO.    for (var i = 0; i ^< text.length; i++^) {
+	ECHO.      hash = Math.imul(hash ^^ text.charCodeAt(i^), 0x01000193^);
+	ECHO.    }
+	ECHO.    return (hash ^>^>^> 0^).toString(36^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function mark_scanned(node^) {
+	ECHO.    messages_in(node^).forEach(function (message^) {
+	ECHO.      message.dataset.mwsHash = text_hash(message.textContent^);
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // With --lazy, messages are registered with an IntersectionObserver and
+	ECHO.  // only marked dirty once they come within mws_lazy_margin of the visible
+	ECHO.  // part of the message list. The margin applies to the element that
+	ECHO.  // scrolls the list, the nearest scrolling element at or above the list.
+	ECHO.  var viewport_observer = null;
+	ECHO.
+	ECHO.  function scroll_parent(node^) {
+	ECHO.    for (var el = node; el ^&^& el !== document.body; el = el.parentElement^) {
+	ECHO.      var overflow = window.getComputedStyle(el^).overflowY;
+	ECHO.      if (overflow === 'auto' ^|^| overflow === 'scroll'^) {
+	ECHO.        return el;
+	ECHO.      }
+	ECHO.    }
+	ECHO.    return null;
+	ECHO.  }
+	ECHO.
+	ECHO.  function start_viewport_observer(target^) {
+	ECHO.    var list = document.getElementById('msgs_div'^) ^|^| target;
+	ECHO.    viewport_observer = new IntersectionObserver(function (entries^) {
+	ECHO.      entries.forEach(function (entry^) {
+	ECHO.        if (entry.isIntersecting^) {
+	ECHO.          viewport_observer.unobserve(entry.target^);
+	ECHO.          mark_dirty(entry.target^);
+	ECHO.        }
+	ECHO.      }^);
+	ECHO.      if (dirty_nodes.length ^> 0^) {
+	ECHO.        request_flush(^);
+	ECHO.      }
+	ECHO.    }, { root: scroll_parent(list^), rootMargin: mws_lazy_margin }^);
+	ECHO.    add_candidate(list^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function add_candidate(node^) {
+	ECHO.    if (!node^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    messages_in(node^).forEach(function (message^) {
+	ECHO.      filter_stats.checked++;
+	ECHO.      var hash = text_hash(message.textContent^);
+	ECHO.      if (message.dataset.mwsHash === hash^) {
+	ECHO.        filter_stats.unchanged++;
+	ECHO.      } else if (!has_math(message^)^) {
+	ECHO.        message.dataset.mwsHash = hash;
+	ECHO.        filter_stats.rejected++;
+	ECHO.      } else if (viewport_observer^) {
+	ECHO.        viewport_observer.observe(message^);
+	ECHO.      } else {
+	ECHO.        mark_dirty(message^);
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // The engines' own changes to the messages are not candidates: rendered
+	ECHO.  // equations (and MathJax's script tags^) are among the skipped tags and
+	ECHO.  // classes. Changes made by render_math(^) are never seen at all (see
+	ECHO.  // quietly^), so any other change to the text of a message, even one that
+	ECHO.  // is being typeset, is Slack's and makes the message dirty again.
+	ECHO.  function engine_mutation(node^) {
+	ECHO.    var element = node.nodeType === Node.ELEMENT_NODE ? node : node.parentElement;
+	ECHO.    return element !== null ^&^& element.closest(skip_selector^) !== null;
+	ECHO.  }
+	ECHO.
+	ECHO.  function handle_records(records^) {
+	ECHO.    records.forEach(function (record^) {
+	ECHO.      var nodes = record.type === 'characterData' ? [record.target] : Array.prototype.slice.call(record.addedNodes^);
+	ECHO.      nodes.forEach(function (node^) {
+	ECHO.        if (engine_mutation(node^)^) {
+	ECHO.          filter_stats.ignored++;
+	ECHO.        } else {
+	ECHO.          add_candidate(node.nodeType === Node.ELEMENT_NODE ? node : node.parentNode^);
+	ECHO.        }
+	ECHO.      }^);
+	ECHO.    }^);
+	ECHO.    if (dirty_nodes.length ^> 0^) {
+	ECHO.      request_flush(^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  var observer = new MutationObserver(handle_records^);
+	ECHO.
+	ECHO.  // Makes a change to the messages without the observer reacting to it.
+	ECHO.  // Mutation records are delivered after every task, so the observer's
+	ECHO.  // queue only holds those of the current task: they are handled first, and
+	ECHO.  // the records of the change itself are dropped.
+	ECHO.  function quietly(change^) {
+	ECHO.    handle_records(observer.takeRecords(^)^);
+	ECHO.    change(^);
+	ECHO.    observer.takeRecords(^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Inline math that is more likely to be prices, after Pandoc's rules: the
+	ECHO.  // TeX may not start or end with whitespace, the closing dollar sign may
+	ECHO.  // not be followed by a digit, and TeX that starts with a digit may not
+	ECHO.  // contain whitespace. Prices such as $5 and $10, or $5-$10, are not math,
+	ECHO.  // while $x$, $2^^n$ and $5$ still are.
+	ECHO.  function currency_like(tex, after^) {
+	ECHO.    return /^^\s^|\s$/.test(tex^) ^|^| /^^[0-9]/.test(after ^|^| ''^) ^|^| (/^^[0-9]/.test(tex^) ^&^& /\s/.test(tex^)^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Splits text into plain text and math the way tex2jax does: $$...$$ is
+	ECHO.  // display math, $...$ inline math and \$ an escaped dollar sign. Inline
+	ECHO.  // math that looks like prices (see currency_like^) is left as text, and
+	ECHO.  // its closing dollar sign may open the next equation.
+	ECHO.  function scan_math(text^) {
+	ECHO.    var segments = [];
+	ECHO.    var plain = '';
+	ECHO.    var i = 0;
+	ECHO.    var open;
+	ECHO.    while ((open = text.indexOf('$', i^)^) !== -1^) {
+	ECHO.      if (text[open - 1] === '\\'^) {
+	ECHO.        plain += text.slice(i, open - 1^) + '$';
+	ECHO.        i = open + 1;
+	ECHO.        continue;
+	ECHO.      }
+	ECHO.      var delimiter = text[open + 1] === '$' ? '$$' : '$';
+	ECHO.      var close = find_closing(text, open + delimiter.length, delimiter^);
+	ECHO.      if (close === -1^) {
+	ECHO.        plain += text.slice(i, open + delimiter.length^);
+	ECHO.        i = open + delimiter.length;
+	ECHO.        continue;
+	ECHO.      }
+	ECHO.      if (delimiter === '$' ^&^& currency_like(text.slice(open + 1, close^), text[close + 1]^)^) {
+	ECHO.        plain += text.slice(i, close^);
+	ECHO.        i = close;
+	ECHO.        continue;
+	ECHO.      }
+	ECHO.      plain += text.slice(i, open^);
+	ECHO.      if (plain^) {
+	ECHO.        segments.push({ text: plain }^);
+	ECHO.        plain = '';
+	ECHO.      }
+	ECHO.      segments.push({
+	ECHO.        tex: text.slice(open + delimiter.length, close^),
+	ECHO.        display: delimiter === '$$',
+	ECHO.        source: text.slice(open, close + delimiter.length^)
+	ECHO.      }^);
+	ECHO.      i = close + delimiter.length;
+	ECHO.    }
+	ECHO.    plain += text.slice(i^);
+	ECHO.    if (plain^) {
+	ECHO.      segments.push({ text: plain }^);
+	ECHO.    }
+	ECHO.    return segments;
+	ECHO.  }
+	ECHO.
+	ECHO.  function find_closing(text, from, delimiter^) {
+	ECHO.    for (var j = from; j ^< text.length; j++^) {
+	ECHO.      if (text[j] === '\\'^) {
+	ECHO.        j++;
+	ECHO.      } else if (text.startsWith(delimiter, j^)^) {
+	ECHO.        return j ^> from ? j : -1;
+	ECHO.      }
+	ECHO.    }
+	ECHO.    return -1;
+	ECHO.  }
+	ECHO.
+	ECHO.  // Limits on the equations that are rendered, so that a single pathological
+	ECHO.  // equation cannot freeze the client. Equations that are too long or too
+	ECHO.  // deeply nested (braces, \left...\right and environments^) are shown as
+	ECHO.  // raw TeX without reaching the engine, and macro expansion is capped by
+	ECHO.  // the engines themselves. Equations that took longer than mws_timeout to
+	ECHO.  // render are remembered and shown as raw TeX from then on; in workers,
+	ECHO.  // rendering is also stopped when the time is up. MathJax 2 renders the
+	ECHO.  // equations of a chunk together in its queue, so they cannot be timed one
+	ECHO.  // by one and mws_timeout does not apply to it. A limit of 0 is no limit.
+	ECHO.  var slow_equations = new Set(^);
+	ECHO.  var tex_command = /\\([a-zA-Z]*^)/g;
+	ECHO.
+	ECHO.  function too_complex(tex^) {
+	ECHO.    if (mws_max_length ^> 0 ^&^& tex.length ^> mws_max_length^) {
+	ECHO.      return true;
+	ECHO.    }
+	ECHO.    var depth = 0;
+	ECHO.    for (var i = 0; i ^< tex.length; i++^) {
+	ECHO.      var opens = tex[i] === '{';
+	ECHO.      var closes = tex[i] === '}';
+	ECHO.      if (tex[i] === '\\'^) {
+	ECHO.        tex_command.lastIndex = i;
+	ECHO.        var name = tex_command.exec(tex^)[1];
+	ECHO.        opens = name === 'left' ^|^| name === 'begin';
+	ECHO.        closes = name === 'right' ^|^| name === 'end';
+	ECHO.        i += Math.max(name.length, 1^);
+	ECHO.      }
+	ECHO.      if (opens^) {
+	ECHO.        depth++;
+	ECHO.      } else if (closes^) {
+	ECHO.        depth--;
+	ECHO.      }
+	ECHO.      if (mws_max_depth ^> 0 ^&^& depth ^> mws_max_depth^) {
+	ECHO.        return true;
+	ECHO.      }
+	ECHO.    }
+	ECHO.    return false;
+	ECHO.  }
+	ECHO.
+	ECHO.  function over_limits(key, tex^) {
+	ECHO.    return slow_equations.has(key^) ^|^| too_complex(tex^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function check_time(key, start^) {
+	ECHO.    if (mws_timeout ^> 0 ^&^& performance.now(^) - start ^> mws_timeout^) {
+	ECHO.      console.warn('math-with-slack: equation took more than ' + mws_timeout + ' ms, it will be shown as TeX'^);
+	ECHO.      slow_equations.add(key^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  function raw_output(source^) {
+	ECHO.    var span = document.createElement('span'^);
+	ECHO.    span.className = 'mws-raw';
+	ECHO.    span.textContent = source;
+	ECHO.    return span;
+	ECHO.  }
+	ECHO.
+	ECHO.  // The tokenizer that finds the math for every engine. Each message's text
+	ECHO.  // is walked once, skipping the skipped tags and classes, and every run of
+	ECHO.  // text (see text_runs^) with math is replaced by its plain text, line
+	ECHO.  // breaks and the equations' output in a single step, without splitting
+	ECHO.  // nodes first. render(segment, callback, node^) passes the output for one
+	ECHO.  // equation in node, or null if it cannot be rendered, to callback,
+	ECHO.  // possibly asynchronously. A run with an equation that cannot be rendered
+	ECHO.  // is left untouched (escapes included^); done(^) is called with the nodes
+	ECHO.  // that contain such runs once every equation has been rendered.
+	ECHO.  function plain_output(text^) {
+	ECHO.    var fragment = document.createDocumentFragment(^);
+	ECHO.    text.split(line_break^).forEach(function (line, i^) {
+	ECHO.      if (i ^> 0^) {
+	ECHO.        fragment.appendChild(document.createElement('br'^)^);
+	ECHO.      }
+	ECHO.      if (line^) {
+	ECHO.        fragment.appendChild(document.createTextNode(line^)^);
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.    return fragment;
+	ECHO.  }
+	ECHO.
+	ECHO.  // Slack may have changed a run while its equations were being rendered
+	ECHO.  function in_place(nodes^) {
+	ECHO.    var parent = nodes[0].parentNode;
+	ECHO.    return parent !== null ^&^& nodes.every(function (n^) { return n.parentNode === parent; }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function render_math(nodes, render, done^) {
+	ECHO.    var failed = [];
+	ECHO.    var waiting = 1;
+	ECHO.    function finish(^) {
+	ECHO.      if (--waiting === 0^) {
+	ECHO.        done(failed^);
 	ECHO.      }
+	ECHO.    }
+	ECHO.    nodes.forEach(function (node^) {
+	ECHO.      text_runs(node^).forEach(function (run^) {
+	ECHO.        var segments = scan_run(run^);
+	ECHO.        var remaining = segments.filter(function (segment^) { return 'tex' in segment; }^).length;
+	ECHO.        if (remaining === 0^) {
+	ECHO.          return;
+	ECHO.        }
+	ECHO.        var rendered = true;
+	ECHO.        var outputs = segments.map(function (segment^) {
+	ECHO.          return 'tex' in segment ? null : plain_output(segment.text^);
+	ECHO.        }^);
+	ECHO.        waiting++;
+	ECHO.        segments.forEach(function (segment, i^) {
+	ECHO.          if (!('tex' in segment^)^) {
+	ECHO.            return;
+	ECHO.          }
+	ECHO.          render(segment, function (output^) {
+	ECHO.            if (output !== null ^&^& typesetting^) {
+	ECHO.              typeset_stats.equations++;
+	ECHO.            }
+	ECHO.            outputs[i] = output;
+	ECHO.            rendered = rendered ^&^& output !== null;
+	ECHO.            if (--remaining ^> 0^) {
+	ECHO.              return;
+	ECHO.            }
+	ECHO.            if (!rendered^) {
+	ECHO.              if (failed.indexOf(node^) === -1^) {
+	ECHO.                failed.push(node^);
+	ECHO.              }
+	ECHO.            } else if (in_place(run.nodes^)^) {
+	ECHO.              var fragment = document.createDocumentFragment(^);
+	ECHO.              outputs.forEach(function (output^) { fragment.appendChild(output^); }^);
+	ECHO.              quietly(function (^) {
+	ECHO.                run.nodes[0].parentNode.insertBefore(fragment, run.nodes[0]^);
+	ECHO.                run.nodes.forEach(function (n^) { n.parentNode.removeChild(n^); }^);
+	ECHO.              }^);
+	ECHO.            }
+	ECHO.            finish(^);
+	ECHO.          }, node^);
+	ECHO.        }^);
+	ECHO.      }^);
 	ECHO.    }^);
-	ECHO.  `;
+	ECHO.    finish(^);
+	ECHO.  }
 	ECHO.
-	ECHO.  var mathjax_observer = document.createElement('script'^);
-	ECHO.  mathjax_observer.type = 'text/x-mathjax-config';
-	ECHO.  mathjax_observer.text = `
+	ECHO.  function katex_output(segment, node^) {
+	ECHO.    var key = ['katex', segment.display, segment.tex].join('\n'^);
+	ECHO.    var output = known_output(node, key^);
+	ECHO.    if (output^) {
+	ECHO.      return output;
+	ECHO.    }
+	ECHO.    if (over_limits(key, segment.tex^) ^|^| is_bad_tex(segment.tex, segment.display^)^) {
+	ECHO.      return raw_output(segment.source^);
+	ECHO.    }
+	ECHO.    var template = document.createElement('template'^);
+	ECHO.    var start = performance.now(^);
+	ECHO.    try {
+	ECHO.      template.innerHTML = katex.renderToString(segment.tex, {
+	ECHO.        displayMode: segment.display,
+	ECHO.        maxExpand: mws_max_macros,
+	ECHO.        throwOnError: true
+	ECHO.      }^);
+	ECHO.    } catch (err^) {
+	ECHO.      return null;
+	ECHO.    }
+	ECHO.    check_time(key, start^);
+	ECHO.    cache_put(key, template.content.firstChild^);
+	ECHO.    record_output(node, key, template.content.firstChild^);
+	ECHO.    return template.content.firstChild;
+	ECHO.  }
+	ECHO.
+	ECHO.  // MathJax 3 on the main thread converts one equation at a time, and its
+	ECHO.  // CHTML stylesheet is brought up to date once a chunk is done. Its output
+	ECHO.  // is not cached, since it relies on the rules in that stylesheet.
+	ECHO.  function mathjax3_output(segment, callback^) {
+	ECHO.    var key = ['chtml', segment.display, segment.tex].join('\n'^);
+	ECHO.    if (over_limits(key, segment.tex^) ^|^| is_bad_tex(segment.tex, segment.display^)^) {
+	ECHO.      callback(raw_output(segment.source^)^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var start = performance.now(^);
+	ECHO.    MathJax.texReset(^);
+	ECHO.    var promise = MathJax.tex2chtmlPromise(segment.tex, { display: segment.display }^);
+	ECHO.    check_time(key, start^);
+	ECHO.    promise.then(function (output^) {
+	ECHO.      if (output.querySelector('[data-mjx-error]'^)^) {
+	ECHO.        add_bad_tex(segment.tex, segment.display^);
+	ECHO.        output = raw_output(segment.source^);
+	ECHO.      }
+	ECHO.      callback(output^);
+	ECHO.    }^).catch(function (err^) {
+	ECHO.      console.error('math-with-slack: ' + err.message^);
+	ECHO.      callback(null^);
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Nodes with math that KaTeX cannot render are typeset by MathJax 2,
+	ECHO.  // which is only loaded the first time this happens.
+	ECHO.  var fallback = { state: 'unloaded', nodes: [] };
+	ECHO.
+	ECHO.  function typeset_fallback(nodes^) {
+	ECHO.    fallback.nodes = fallback.nodes.concat(nodes^);
+	ECHO.    if (fallback.state === 'unloaded'^) {
+	ECHO.      fallback.state = 'loading';
+	ECHO.      engines.mathjax2.load(function (^) {
+	ECHO.        fallback.state = 'ready';
+	ECHO.        typeset_fallback([]^);
+	ECHO.      }^);
+	ECHO.    } else if (fallback.state === 'ready' ^&^& fallback.nodes.length ^> 0^) {
+	ECHO.      var pending = fallback.nodes;
+	ECHO.      fallback.nodes = [];
+	ECHO.      engines.mathjax2.typeset(pending, save_cache^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  // With --worker, TeX is rendered to SVG markup by MathJax 3 in a pool of
+	ECHO.  // Web Workers, using its DOM-less lite adaptor; the main thread only swaps
+	ECHO.  // the markup in. worker_main(^) is the workers' source. Local MathJax files
+	ECHO.  // are handed to the workers as blob URLs, since a worker cannot load file
+	ECHO.  // URLs.
+	ECHO.  function worker_main(^) {
+	ECHO.    var files = {};
+	ECHO.    self.onmessage = function (event^) {
+	ECHO.      var message = event.data;
+	ECHO.      if (message.type === 'init'^) {
+	ECHO.        files = message.files;
+	ECHO.        self.MathJax = {
+	ECHO.          loader: {
+	ECHO.            load: ['adaptors/liteDOM', '[tex]/noerrors'],
+	ECHO.            paths: { mathjax: message.root },
+	ECHO.            require: function (url^) { importScripts(files[url] ^|^| url^); }
+	ECHO.          },
+	ECHO.          tex: {
+	ECHO.            packages: { '[+]': ['noerrors'] },
+	ECHO.            maxMacros: message.max_macros
+	ECHO.          },
+	ECHO.          svg: {
+	ECHO.            fontCache: 'none'
+	ECHO.          },
+	ECHO.          startup: {
+	ECHO.            adaptor: 'liteAdaptor',
+	ECHO.            typeset: false,
+	ECHO.            ready: function (^) {
+	ECHO.              MathJax.startup.defaultReady(^);
+	ECHO.              MathJax.startup.promise.then(function (^) {
+	ECHO.                self.postMessage({ type: 'ready', version: MathJax.version }^);
+	ECHO.              }^);
+	ECHO.            }
+	ECHO.          }
+	ECHO.        };
+	ECHO.        importScripts(files[message.main] ^|^| message.main^);
+	ECHO.      } else if (message.type === 'render'^) {
+	ECHO.        MathJax.tex2svgPromise(message.tex, { display: message.display }^).then(function (node^) {
+	ECHO.          var html = MathJax.startup.adaptor.outerHTML(node^);
+	ECHO.          self.postMessage({ type: 'result', html: html, bad: html.indexOf('data-mjx-error'^) !== -1 }^);
+	ECHO.        }^).catch(function (err^) {
+	ECHO.          self.postMessage({ type: 'result', error: err.message }^);
+	ECHO.        }^);
+	ECHO.      }
+	ECHO.    };
+	ECHO.  }
+	ECHO.
+	ECHO.  // Each worker renders one equation at a time. Equations wait in a queue
+	ECHO.  // ordered by priority (lower first, then in the order they were asked
+	ECHO.  // for^), so that messages in view are rendered before the backlog of a
+	ECHO.  // channel that was just opened. An equation that is already waiting is
+	ECHO.  // not queued twice.
+	ECHO.  var worker_pool = {
+	ECHO.    workers: [], starting: 0, queue: [], waiting: new Map(^),
+	ECHO.    version: null, ready: null, fail: null, url: null, init: null
+	ECHO.  };
+	ECHO.
+	ECHO.  // Local files are read with Node's fs, which Slack's loader leaves in
+	ECHO.  // scope, and outside Slack (in benchmark/^) with a synchronous request.
+	ECHO.  function read_file(url^) {
+	ECHO.    if (typeof require === 'function'^) {
+	ECHO.      return require('fs'^).readFileSync(require('url'^).fileURLToPath(url^)^);
+	ECHO.    }
+	ECHO.    var request = new XMLHttpRequest(^);
+	ECHO.    request.open('GET', url, false^);
+	ECHO.    request.send(^);
+	ECHO.    if (!request.responseText^) {
+	ECHO.      throw new Error('cannot read ' + url^);
+	ECHO.    }
+	ECHO.    return request.responseText;
+	ECHO.  }
+	ECHO.
+	ECHO.  function start_workers(ready, fail^) {
+	ECHO.    var root = mws_mathjax_url.replace(/\/[^^\/]*$/, ''^);
+	ECHO.    var main = root + '/tex-svg.js';
+	ECHO.    var files = {};
+	ECHO.    var count = mws_worker_count ^|^| Math.max(1, (navigator.hardwareConcurrency ^|^| 2^) - 1^);
+	ECHO.    var reason = null;
+	ECHO.    worker_pool.ready = ready;
+	ECHO.    worker_pool.fail = fail;
+	ECHO.    try {
+	ECHO.      if (root.indexOf('file:'^) === 0^) {
+	ECHO.        [main, root + '/adaptors/liteDOM.js', root + '/input/tex/extensions/noerrors.js'].forEach(function (file^) {
+	ECHO.          files[file] = URL.createObjectURL(new Blob([read_file(file^)], { type: 'text/javascript' }^)^);
+	ECHO.        }^);
+	ECHO.      }
+	ECHO.      var source = '(' + worker_main.toString(^) + '^)(^);';
+	ECHO.      worker_pool.url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }^)^);
+	ECHO.      worker_pool.init = { type: 'init', root: root, main: main, files: files, max_macros: mws_max_macros };
+	ECHO.      for (var i = 0; i ^< count; i++^) {
+	ECHO.        start_worker(^);
+	ECHO.      }
+	ECHO.    } catch (err^) {
+	ECHO.      reason = err.message;
+	ECHO.    }
+	ECHO.    if (worker_pool.starting === 0^) {
+	ECHO.      fail(reason^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  function start_worker(^) {
+	ECHO.    var entry = { worker: new Worker(worker_pool.url^), job: null, timer: null };
+	ECHO.    worker_pool.starting++;
+	ECHO.    entry.worker.onmessage = function (event^) {
+	ECHO.      var message = event.data;
+	ECHO.      if (message.type === 'ready'^) {
+	ECHO.        worker_pool.starting--;
+	ECHO.        worker_pool.workers.push(entry^);
+	ECHO.        if (worker_pool.version === null^) {
+	ECHO.          worker_pool.version = message.version;
+	ECHO.          worker_pool.ready(^);
+	ECHO.        }
+	ECHO.        worker_dispatch(^);
+	ECHO.      } else if (message.type === 'result'^) {
+	ECHO.        var job = entry.job;
+	ECHO.        window.clearTimeout(entry.timer^);
+	ECHO.        entry.job = null;
+	ECHO.        job.done(message^);
+	ECHO.        worker_dispatch(^);
+	ECHO.      }
+	ECHO.    };
+	ECHO.    entry.worker.onerror = function (event^) {
+	ECHO.      event.preventDefault(^);
+	ECHO.      window.clearTimeout(entry.timer^);
+	ECHO.      entry.worker.terminate(^);
+	ECHO.      var index = worker_pool.workers.indexOf(entry^);
+	ECHO.      if (index === -1^) {
+	ECHO.        worker_pool.starting--;
+	ECHO.      } else {
+	ECHO.        worker_pool.workers.splice(index, 1^);
+	ECHO.      }
+	ECHO.      if (entry.job^) {
+	ECHO.        entry.job.done({ error: event.message }^);
+	ECHO.        entry.job = null;
+	ECHO.      }
+	ECHO.      worker_stopped(event.message^);
+	ECHO.    };
+	ECHO.    entry.worker.postMessage(worker_pool.init^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // A worker that is still rendering when mws_timeout is up is replaced by
+	ECHO.  // a new one, and its equation is shown as raw TeX.
+	ECHO.  function worker_timeout(entry^) {
+	ECHO.    entry.worker.terminate(^);
+	ECHO.    worker_pool.workers.splice(worker_pool.workers.indexOf(entry^), 1^);
+	ECHO.    slow_equations.add(entry.job.key^);
+	ECHO.    console.warn('math-with-slack: equation took more than ' + mws_timeout + ' ms, it will be shown as TeX'^);
+	ECHO.    entry.job.done({ timeout: true }^);
+	ECHO.    try {
+	ECHO.      start_worker(^);
+	ECHO.    } catch (err^) {
+	ECHO.      worker_stopped(err.message^);
+	ECHO.    }
+	ECHO.    worker_dispatch(^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Called when a worker fails. Once none are left, waiting equations are
+	ECHO.  // given up on and math is typeset on the main thread from then on.
+	ECHO.  function worker_stopped(reason^) {
+	ECHO.    if (worker_pool.workers.length ^> 0 ^|^| worker_pool.starting ^> 0^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    // The engine is switched before the queued jobs are ended, since ending
+	ECHO.    // them can end the chunk and flush the next one
+	ECHO.    var queue = worker_pool.queue;
+	ECHO.    worker_pool.queue = [];
+	ECHO.    if (worker_pool.version !== null^) {
+	ECHO.      console.warn('math-with-slack: workers stopped (' + reason + '^)'^);
+	ECHO.      engine = engines.mathjax3;
+	ECHO.      engine_state = 'unloaded';
+	ECHO.    }
+	ECHO.    queue.forEach(function (job^) { job.done({ error: reason }^); }^);
+	ECHO.    if (worker_pool.version === null^) {
+	ECHO.      worker_pool.fail(reason^);
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  function worker_dispatch(^) {
+	ECHO.    worker_pool.workers.forEach(function (entry^) {
+	ECHO.      if (!entry.job ^&^& worker_pool.queue.length ^> 0^) {
+	ECHO.        entry.job = worker_pool.queue.shift(^);
+	ECHO.        entry.worker.postMessage({ type: 'render', tex: entry.job.tex, display: entry.job.display }^);
+	ECHO.        if (mws_timeout ^> 0^) {
+	ECHO.          entry.timer = window.setTimeout(worker_timeout, mws_timeout, entry^);
+	ECHO.        }
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function worker_output(segment, callback, priority, node^) {
+	ECHO.    var key = ['svg', segment.display, segment.tex].join('\n'^);
+	ECHO.    var output = known_output(node, key^);
+	ECHO.    if (output^) {
+	ECHO.      callback(output^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    if (over_limits(key, segment.tex^) ^|^| is_bad_tex(segment.tex, segment.display^)^) {
+	ECHO.      callback(raw_output(segment.source^)^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    if (worker_pool.workers.length === 0 ^&^& worker_pool.starting === 0^) {
+	ECHO.      callback(null^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var rendered = function (output^) {
+	ECHO.      if (output^) {
+	ECHO.        record_output(node, key, output^);
+	ECHO.      }
+	ECHO.      callback(output^);
+	ECHO.    };
+	ECHO.    if (worker_pool.waiting.has(key^)^) {
+	ECHO.      worker_pool.waiting.get(key^).callbacks.push(rendered^);
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var job = { key: key, tex: segment.tex, display: segment.display, priority: priority, callbacks: [rendered] };
+	ECHO.    job.done = function (result^) {
+	ECHO.      worker_pool.waiting.delete(key^);
+	ECHO.      if (result.bad^) {
+	ECHO.        add_bad_tex(segment.tex, segment.display^);
+	ECHO.      }
+	ECHO.      if (result.timeout ^|^| result.bad^) {
+	ECHO.        job.callbacks.forEach(function (callback^) { callback(raw_output(segment.source^)^); }^);
+	ECHO.        return;
+	ECHO.      }
+	ECHO.      var template = document.createElement('template'^);
+	ECHO.      if (result.error === undefined^) {
+	ECHO.        template.innerHTML = result.html;
+	ECHO.        cache_put(key, template.content.firstChild^);
+	ECHO.      }
+	ECHO.      job.callbacks.forEach(function (callback^) {
+	ECHO.        callback(result.error === undefined ? template.content.firstChild.cloneNode(true^) : null^);
+	ECHO.      }^);
+	ECHO.    };
+	ECHO.    var i = worker_pool.queue.length;
+	ECHO.    while (i ^> 0 ^&^& worker_pool.queue[i - 1].priority ^> priority^) {
+	ECHO.      i--;
+	ECHO.    }
+	ECHO.    worker_pool.queue.splice(i, 0, job^);
+	ECHO.    worker_pool.waiting.set(key, job^);
+	ECHO.    worker_dispatch(^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function load_script(url, onload^) {
+	ECHO.    var script = document.createElement('script'^);
+	ECHO.    script.type = 'text/javascript';
+	ECHO.    script.src = url;
+	ECHO.    script.onload = onload;
+	ECHO.    document.head.appendChild(script^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function load_engine(^) {
+	ECHO.    if (engine_state !== 'unloaded'^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    engine_state = 'loading';
+	ECHO.    var requested = performance.now(^);
+	ECHO.    timeline_mark('engine-load'^);
+	ECHO.    engine.load(function (^) {
+	ECHO.      timeline_mark('engine-ready'^);
+	ECHO.      console.info('math-with-slack: ' + engine.version(^) + ' started in ' + Math.round(performance.now(^) - requested^) + ' ms'^);
+	ECHO.      load_cache(function (^) {
+	ECHO.        engine_state = 'ready';
+	ECHO.        request_flush(^);
+	ECHO.      }^);
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Startup timeline. The loader in ssb-interop.js marks when it starts
+	ECHO.  // reading this file and when it has read it, and the payload when it has
+	ECHO.  // been evaluated, when the DOM is ready, when it starts observing the
+	ECHO.  // message list, when the engine is requested and ready, and when the
+	ECHO.  // first typeset is done. Phases are recorded once each, as performance
+	ECHO.  // marks named mws-*, and are appended to mws_timeline_log (if set^) as a
+	ECHO.  // line of JSON after the first typeset.
+	ECHO.  var timeline_phases = ['loader', 'read', 'eval', 'dom-ready', 'observing', 'engine-load', 'engine-ready', 'first-typeset'];
+	ECHO.
+	ECHO.  function timeline_mark(phase^) {
+	ECHO.    if (performance.getEntriesByName('mws-' + phase, 'mark'^).length ^> 0^) {
+	ECHO.      return false;
+	ECHO.    }
+	ECHO.    performance.mark('mws-' + phase^);
+	ECHO.    return true;
+	ECHO.  }
+	ECHO.
+	ECHO.  // Milliseconds since the client started, and since the previous phase
+	ECHO.  function timeline(^) {
+	ECHO.    var previous = 0;
+	ECHO.    return timeline_phases.map(function (phase^) {
+	ECHO.      var mark = performance.getEntriesByName('mws-' + phase, 'mark'^)[0];
+	ECHO.      if (!mark^) {
+	ECHO.        return null;
+	ECHO.      }
+	ECHO.      var entry = { phase: phase, ms: Math.round(mark.startTime * 10^) / 10, delta: Math.round((mark.startTime - previous^) * 10^) / 10 };
+	ECHO.      previous = mark.startTime;
+	ECHO.      return entry;
+	ECHO.    }^).filter(function (entry^) { return entry !== null; }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  function write_timeline(^) {
+	ECHO.    if (!mws_timeline_log ^|^| typeof require !== 'function'^) {
+	ECHO.      return;
+	ECHO.    }
+	ECHO.    var line = JSON.stringify({ date: new Date(^).toISOString(^), version: mws_version, engine: engine.version(^), timeline: timeline(^) }^);
+	ECHO.    require('fs'^).appendFile(mws_timeline_log, line + '\n', function (error^) {
+	ECHO.      if (error^) {
+	ECHO.        console.warn('math-with-slack: cannot write the timeline to ' + mws_timeline_log + ' (' + error.message + '^)'^);
+	ECHO.      }
+	ECHO.    }^);
+	ECHO.  }
+	ECHO.
+	ECHO.  // Only the observer and the pre-filter run at startup. The message list
+	ECHO.  // is created by Slack's own scripts, so it is polled for until it exists.
+	ECHO.  function observe_messages(^) {
 	ECHO.    var target = document.querySelector('#messages_container'^);
+	ECHO.    if (!target^) {
+	ECHO.      window.setTimeout(observe_messages, 500^);
+	ECHO.      return;
+	ECHO.    }
 	ECHO.    var options = { attributes: false, childList: true, characterData: true, subtree: true };
-	ECHO.    var observer = new MutationObserver(function (r, o^) { MathJax.Hub.Queue(['Typeset', MathJax.Hub]^); }^);
 	ECHO.    observer.observe(target, options^);
-	ECHO.  `;
+	ECHO.    timeline_mark('observing'^);
+	ECHO.    if (mws_lazy_margin !== null^) {
+	ECHO.      start_viewport_observer(target^);
+	ECHO.    } else {
+	ECHO.      add_candidate(document.getElementById('msgs_div'^) ^|^| target^);
+	ECHO.      if (dirty_nodes.length ^> 0^) {
+	ECHO.        request_flush(^);
+	ECHO.      }
+	ECHO.    }
+	ECHO.  }
+	ECHO.
+	ECHO.  // The engines --engine chooses from. load(^) loads the engine and calls
+	ECHO.  // ready(^) once it can typeset; typeset(^) renders the math in an array of
+	ECHO.  // nodes and then calls done(^). All engines find math with render_math(^),
+	ECHO.  // and use the same TeX extensions.
+	ECHO.  var engines = {
+	ECHO.    mathjax2: {
+	ECHO.      // MathJax is told where the rest of its files are, since the bundle is
+	ECHO.      // not called MathJax.js, and to hold startup until the bundle has
+	ECHO.      // fully loaded.
+	ECHO.      load: function (ready^) {
+	ECHO.        window.MathJax = {
+	ECHO.          root: mws_mathjax_url.replace(/\/[^^\/]*$/, ''^),
+	ECHO.          delayStartupUntil: mws_mathjax_bundled ? 'configured' : 'none',
+	ECHO.          messageStyle: 'none',
+	ECHO.          skipStartupTypeset: true,
+	ECHO.          jax: ['input/TeX', 'output/HTML-CSS'],
+	ECHO.          TeX: {
+	ECHO.            extensions: ['AMSmath.js', 'AMSsymbols.js', 'noErrors.js', 'noUndefined.js'],
+	ECHO.            MAXMACROS: mws_max_macros
+	ECHO.          },
+	ECHO.          'HTML-CSS': {
+	ECHO.            imageFont: null
+	ECHO.          },
+	ECHO.          AuthorInit: function (^) {
+	ECHO.            MathJax.Hub.Register.StartupHook('End', ready^);
+	ECHO.          }
+	ECHO.        };
+	ECHO.        load_script(mws_mathjax_url, function (^) {
+	ECHO.          if (mws_mathjax_bundled^) {
+	ECHO.            MathJax.Hub.Configured(^);
+	ECHO.          }
+	ECHO.        }^);
+	ECHO.      },
+	ECHO.      version: function (^) {
+	ECHO.        return 'MathJax ' + MathJax.version;
+	ECHO.      },
+	ECHO.      typeset: function (nodes, done^) {
+	ECHO.        var pending = [];
+	ECHO.        render_math(nodes, function (segment, callback, node^) {
+	ECHO.          callback(mathjax2_output(segment, node, pending^)^);
+	ECHO.        }, function (^) {
+	ECHO.          MathJax.Hub.Queue(['Process', MathJax.Hub, nodes], function (^) {
+	ECHO.            fill_cache(pending^);
+	ECHO.            done(^);
+	ECHO.          }^);
+	ECHO.        }^);
+	ECHO.      }
+	ECHO.    },
+	ECHO.    mathjax3: {
+	ECHO.      load: function (ready^) {
+	ECHO.        window.MathJax = {
+	ECHO.          loader: {
+	ECHO.            load: ['[tex]/noerrors']
+	ECHO.          },
+	ECHO.          tex: {
+	ECHO.            packages: { '[+]': ['noerrors'] },
+	ECHO.            maxMacros: mws_max_macros
+	ECHO.          },
+	ECHO.          startup: {
+	ECHO.            typeset: false,
+	ECHO.            ready: function (^) {
+	ECHO.              MathJax.startup.defaultReady(^);
+	ECHO.              MathJax.startup.promise.then(ready^);
+	ECHO.            }
+	ECHO.          }
+	ECHO.        };
+	ECHO.        load_script(mws_mathjax_url^);
+	ECHO.      },
+	ECHO.      version: function (^) {
+	ECHO.        return 'MathJax ' + MathJax.version;
+	ECHO.      },
+	ECHO.      typeset: function (nodes, done^) {
+	ECHO.        render_math(nodes, mathjax3_output, function (^) {
+	ECHO.          MathJax.startup.document.clear(^);
+	ECHO.          MathJax.startup.document.updateDocument(^);
+	ECHO.          done(^);
+	ECHO.        }^);
+	ECHO.      }
+	ECHO.    },
+	ECHO.    katex: {
+	ECHO.      load: function (ready^) {
+	ECHO.        var stylesheet = document.createElement('link'^);
+	ECHO.        stylesheet.rel = 'stylesheet';
+	ECHO.        stylesheet.href = mws_katex_url + '/katex.min.css';
+	ECHO.        document.head.appendChild(stylesheet^);
+	ECHO.        load_script(mws_katex_url + '/katex.min.js', ready^);
+	ECHO.      },
+	ECHO.      version: function (^) {
+	ECHO.        return 'KaTeX ' + katex.version;
+	ECHO.      },
+	ECHO.      typeset: function (nodes, done^) {
+	ECHO.        render_math(nodes, function (segment, callback, node^) {
+	ECHO.          callback(katex_output(segment, node^)^);
+	ECHO.        }, function (failed^) {
+	ECHO.          if (failed.length ^> 0^) {
+	ECHO.            typeset_fallback(failed^);
+	ECHO.          }
+	ECHO.          done(^);
+	ECHO.        }^);
+	ECHO.      }
+	ECHO.    },
+	ECHO.    // Renders with MathJax 3 in workers (see worker_main^), or on the main
+	ECHO.    // thread if no worker can be started. Equations in messages that are in
+	ECHO.    // view go first.
+	ECHO.    worker: {
+	ECHO.      load: function (ready^) {
+	ECHO.        var style = document.createElement('style'^);
+	ECHO.        style.textContent = 'mjx-container[jax=SVG] { direction: ltr; }' +
+	ECHO.          ' mjx-container[jax=SVG][display=true] { display: block; text-align: center; margin: 1em 0; }';
+	ECHO.        document.head.appendChild(style^);
+	ECHO.        start_workers(ready, function (reason^) {
+	ECHO.          console.warn('math-with-slack: cannot start workers (' + reason + '^), typesetting on the main thread'^);
+	ECHO.          engine = engines.mathjax3;
+	ECHO.          engine.load(ready^);
+	ECHO.        }^);
+	ECHO.      },
+	ECHO.      version: function (^) {
+	ECHO.        return 'MathJax ' + worker_pool.version + ' (workers^)';
+	ECHO.      },
+	ECHO.      typeset: function (nodes, done^) {
+	ECHO.        var visible = nodes.filter(in_viewport^);
+	ECHO.        render_math(nodes, function (segment, callback, node^) {
+	ECHO.          worker_output(segment, callback, visible.indexOf(node^) === -1 ? 1 : 0, node^);
+	ECHO.        }, function (^) { done(^); }^);
+	ECHO.      }
+	ECHO.    }
+	ECHO.  };
+	ECHO.  var engine = mws_worker ? engines.worker : engines[mws_engine];
 	ECHO.
-	ECHO.  var mathjax_script = document.createElement('script'^);
-	ECHO.  mathjax_script.type = 'text/javascript';
-	ECHO.  mathjax_script.src = 'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJax.js';
+	ECHO.  window.mathWithSlack = {
+	ECHO.    cache: function (^) {
+	ECHO.      return {
+	ECHO.        entries: render_cache.entries.size,
+	ECHO.        bytes: render_cache.bytes,
+	ECHO.        limit: mws_cache_size,
+	ECHO.        hits: render_cache.hits,
+	ECHO.        misses: render_cache.misses,
+	ECHO.        reused: edit_stats.reused,
+	ECHO.        bad: bad_tex.hashes.size
+	ECHO.      };
+	ECHO.    },
+	ECHO.    // Marks up the math under node as MathJax 2 scripts without rendering
+	ECHO.    // it, and returns the number of equations found (see benchmark/^)
+	ECHO.    tokenize: function (node^) {
+	ECHO.      var count = 0;
+	ECHO.      render_math([node], function (segment, callback^) {
+	ECHO.        count++;
+	ECHO.        callback(math_script(segment^)^);
+	ECHO.      }, function (^) {}^);
+	ECHO.      return count;
+	ECHO.    },
+	ECHO.    filter: function (^) {
+	ECHO.      return {
+	ECHO.        checked: filter_stats.checked,
+	ECHO.        rejected: filter_stats.rejected,
+	ECHO.        unchanged: filter_stats.unchanged,
+	ECHO.        ignored: filter_stats.ignored
+	ECHO.      };
+	ECHO.    },
+	ECHO.    // Number of nodes waiting to be typeset or being typeset
+	ECHO.    pending: queue_depth,
+	ECHO.    stats: stats,
+	ECHO.    timeline: timeline
+	ECHO.  };
 	ECHO.
-	ECHO.  document.head.appendChild(mathjax_config^);
-	ECHO.  document.head.appendChild(mathjax_observer^);
-	ECHO.  document.head.appendChild(mathjax_script^);
+	ECHO.  observe_messages(^);
 	ECHO.}^);
+	ECHO.
+	ECHO.performance.mark('mws-eval'^);
 )
 
 
@@ -180,7 +1818,8 @@ FOR /F "delims=" %%L IN (%SLACK_SSB_INTEROP%.mwsbak) DO (
 		>>"%SLACK_SSB_INTEROP%" (
 			ECHO.  // ** math-with-slack %MWS_VERSION% ** https://github.com/fsavje/math-with-slack
 			ECHO.  var mwsp = path.join(__dirname, 'math-with-slack.js'^).replace('app.asar', 'app.asar.unpacked'^);
-			ECHO.  require('fs'^).readFile(mwsp, 'utf8', (e, r^) =^> { if (e^) { throw e; } else { eval(r^); } }^);
+			ECHO.  performance.mark('mws-loader'^);
+			ECHO.  require('fs'^).readFile(mwsp, 'utf8', (e, r^) =^> { if (e^) { throw e; } else { performance.mark('mws-read'^); eval(r^); } }^);
 			ECHO.
 			ECHO.  init(resourcePath, mainModule, !isDevMode^);
 		)
@@ -194,3 +1833,22 @@ FOR /F "delims=" %%L IN (%SLACK_SSB_INTEROP%.mwsbak) DO (
 
 ECHO math-with-slack has been installed. Please restart the Slack client.
 PAUSE & EXIT /B 0
+
+
+:: Subroutines for the local MathJax bundle
+
+:preload_component
+SET "COMPONENT=%~1"
+IF NOT EXIST "%SLACK_MATHJAX_DIR%\%COMPONENT:/=\%" (
+	ECHO Cannot find MathJax component: %COMPONENT%
+	EXIT /B 1
+)
+SET "PRELOADING=%PRELOADING%, '[MathJax]/%COMPONENT%'"
+SET /A "BUNDLE_FILES+=1"
+EXIT /B 0
+
+:bundle_component
+SET "COMPONENT=%~1"
+TYPE "%SLACK_MATHJAX_DIR%\%COMPONENT:/=\%" >>"%MATHJAX_BUNDLE%"
+>>"%MATHJAX_BUNDLE%" ECHO.
+EXIT /B 0
@@ -19,6 +19,25 @@
 ## Constants
 
 MWS_VERSION="v0.2.5"
+MATHJAX2_VERSION="2.7.4"
+MATHJAX3_VERSION="3.2.2"
+KATEX_VERSION="0.16.9"
+KATEX_ARCHIVE_URL="https://github.com/KaTeX/KaTeX/releases/download/v$KATEX_VERSION/katex.tar.gz"
+
+# Components loaded by the MathJax configuration in the payload (and their
+# dependencies), in the order they are combined into the local bundle
+MATHJAX_COMPONENTS=(
+	"jax/input/TeX/config.js"
+	"jax/output/HTML-CSS/config.js"
+	"extensions/MathEvents.js"
+	"jax/element/mml/jax.js"
+	"extensions/TeX/noErrors.js"
+	"extensions/TeX/noUndefined.js"
+	"jax/input/TeX/jax.js"
+	"extensions/TeX/AMSmath.js"
+	"extensions/TeX/AMSsymbols.js"
+	"jax/output/HTML-CSS/jax.js"
+)
 
 
 ## Functions
@@ -31,14 +50,116 @@ error() {
 
 ## User input
 
-for p in "$@"; do
-	if [ "$p" = "-u" ]; then
-		UNINSTALL="$p"
-	else
-		SLACK_DIR="$p"
-	fi
+ENGINE="mathjax2"
+LAZY_MARGIN="null"
+CACHE_SIZE="4"
+WORKER="false"
+WORKER_COUNT="0"
+CHUNK_BUDGET="8"
+MAX_LENGTH="2000"
+MAX_DEPTH="40"
+MAX_MACROS="10000"
+TIMEOUT="1000"
+TIMELINE_LOG=""
+
+while [ $# -gt 0 ]; do
+	case "$1" in
+		-u)
+			UNINSTALL="$1"
+			;;
+		--lazy)
+			[[ "$2" =~ ^(0|[1-9][0-9]*)$ ]] || error "--lazy expects a margin in pixels, e.g., --lazy 800"
+			LAZY_MARGIN="'$2px'"
+			shift
+			;;
+		--engine)
+			[[ "$2" =~ ^(mathjax2|mathjax3|katex)$ ]] || error "--engine expects mathjax2, mathjax3 or katex"
+			ENGINE="$2"
+			shift
+			if [ "$ENGINE" = "katex" ] && [ -f "$2" ]; then
+				KATEX_ARCHIVE="$2"
+				shift
+			fi
+			;;
+		--local)
+			LOCAL="$1"
+			if [ -f "$2" ]; then
+				MATHJAX_ARCHIVE="$2"
+				shift
+			fi
+			;;
+		--worker)
+			WORKER="true"
+			if [[ "$2" =~ ^(0|[1-9][0-9]*)$ ]]; then
+				WORKER_COUNT="$2"
+				shift
+			fi
+			;;
+		--chunk-budget)
+			[[ "$2" =~ ^(0|[1-9][0-9]*)$ ]] || error "--chunk-budget expects a time in milliseconds, e.g., --chunk-budget 8"
+			CHUNK_BUDGET="$2"
+			shift
+			;;
+		--max-length)
+			[[ "$2" =~ ^(0|[1-9][0-9]*)$ ]] || error "--max-length expects a number of characters, e.g., --max-length 2000"
+			MAX_LENGTH="$2"
+			shift
+			;;
+		--max-depth)
+			[[ "$2" =~ ^(0|[1-9][0-9]*)$ ]] || error "--max-depth expects a nesting depth, e.g., --max-depth 40"
+			MAX_DEPTH="$2"
+			shift
+			;;
+		--max-macros)
+			[[ "$2" =~ ^[1-9][0-9]*$ ]] || error "--max-macros expects a number of macro expansions, e.g., --max-macros 10000"
+			MAX_MACROS="$2"
+			shift
+			;;
+		--timeout)
+			[[ "$2" =~ ^(0|[1-9][0-9]*)$ ]] || error "--timeout expects a time in milliseconds, e.g., --timeout 1000; it does not apply to MathJax 2"
+			TIMEOUT="$2"
+			shift
+			;;
+		--cache-size)
+			[[ "$2" =~ ^(0|[1-9][0-9]{0,3})$ ]] && (( $2 <= 1024 )) || error "--cache-size expects a size in megabytes, at most 1024, e.g., --cache-size 4"
+			CACHE_SIZE="$2"
+			shift
+			;;
+		--timeline-log)
+			[ -n "$2" ] || error "--timeline-log expects a file, e.g., --timeline-log ~/mws-timeline.log"
+			TIMELINE_LOG="$2"
+			[[ "$TIMELINE_LOG" = /* ]] || TIMELINE_LOG="$PWD/$TIMELINE_LOG"
+			shift
+			;;
+		*)
+			SLACK_DIR="$1"
+			;;
+	esac
+	shift
 done
 
+if [ "$WORKER" = "true" ] && [ "$ENGINE" != "mathjax3" ]; then
+	error "--worker requires --engine mathjax3"
+fi
+
+
+## Engine settings
+
+# KaTeX falls back on MathJax 2 for equations it cannot render
+if [ "$ENGINE" = "mathjax3" ]; then
+	MATHJAX_VERSION="$MATHJAX3_VERSION"
+	MATHJAX_CDN_URL="https://cdnjs.cloudflare.com/ajax/libs/mathjax/$MATHJAX_VERSION/es5/tex-chtml.js"
+	MATHJAX_ARCHIVE_URL="https://registry.npmjs.org/mathjax/-/mathjax-$MATHJAX_VERSION.tgz"
+	MATHJAX_ARCHIVE_DIR="package/es5"
+	MATHJAX_MAIN="tex-chtml.js"
+else
+	MATHJAX_VERSION="$MATHJAX2_VERSION"
+	MATHJAX_CDN_URL="https://cdnjs.cloudflare.com/ajax/libs/mathjax/$MATHJAX_VERSION/MathJax.js"
+	MATHJAX_ARCHIVE_URL="https://github.com/mathjax/MathJax/archive/$MATHJAX_VERSION.zip"
+	MATHJAX_ARCHIVE_DIR="MathJax-$MATHJAX_VERSION"
+	MATHJAX_MAIN="MathJax.js"
+fi
+
 
 ## Platform settings
 
@@ -73,6 +194,8 @@ fi
 
 SLACK_MATHJAX_SCRIPT="$SLACK_DIR/math-with-slack.js"
 SLACK_SSB_INTEROP="$SLACK_DIR/ssb-interop.js"
+SLACK_MATHJAX_DIR="$SLACK_DIR/mathjax"
+SLACK_KATEX_DIR="$SLACK_DIR/katex"
 
 
 ## Check so installation exists and is writable
@@ -96,6 +219,14 @@ if [ -e "$SLACK_MATHJAX_SCRIPT" ]; then
 	rm $SLACK_MATHJAX_SCRIPT
 fi
 
+if [ -e "$SLACK_MATHJAX_DIR" ]; then
+	rm -r "$SLACK_MATHJAX_DIR"
+fi
+
+if [ -e "$SLACK_KATEX_DIR" ]; then
+	rm -r "$SLACK_KATEX_DIR"
+fi
+
 
 ## Restore previous injections
 
@@ -119,51 +250,1535 @@ if [ -n "$UNINSTALL" ]; then
 fi
 
 
+## Install MathJax locally
+
+MATHJAX_URL="$MATHJAX_CDN_URL"
+MATHJAX_BUNDLED="false"
+
+if [ -n "$LOCAL" ]; then
+	MATHJAX_TMP="$(mktemp -d)"
+	if [ -z "$MATHJAX_ARCHIVE" ]; then
+		echo "Downloading MathJax $MATHJAX_VERSION from: $MATHJAX_ARCHIVE_URL"
+		MATHJAX_ARCHIVE="$MATHJAX_TMP/$(basename "$MATHJAX_ARCHIVE_URL")"
+		curl -sSfL -o "$MATHJAX_ARCHIVE" "$MATHJAX_ARCHIVE_URL" || error "Cannot download MathJax."
+	fi
+	if [[ "$MATHJAX_ARCHIVE" == *.zip ]]; then
+		unzip -q "$MATHJAX_ARCHIVE" -d "$MATHJAX_TMP" || error "Cannot unpack MathJax archive: $MATHJAX_ARCHIVE"
+	else
+		tar -xzf "$MATHJAX_ARCHIVE" -C "$MATHJAX_TMP" || error "Cannot unpack MathJax archive: $MATHJAX_ARCHIVE"
+	fi
+	if [ ! -e "$MATHJAX_TMP/$MATHJAX_ARCHIVE_DIR/$MATHJAX_MAIN" ]; then
+		error "Archive does not contain MathJax $MATHJAX_VERSION: $MATHJAX_ARCHIVE"
+	fi
+	mv "$MATHJAX_TMP/$MATHJAX_ARCHIVE_DIR" "$SLACK_MATHJAX_DIR"
+	rm -rf "$MATHJAX_TMP"
+	echo "Installed MathJax $MATHJAX_VERSION at: $SLACK_MATHJAX_DIR"
+	MATHJAX_URL="file://$SLACK_MATHJAX_DIR/$MATHJAX_MAIN"
+	MATHJAX_BUNDLED="false"
+fi
+
+if [ -n "$LOCAL" ] && [ "$ENGINE" != "mathjax3" ]; then
+	# Drop what the payload never loads (sources, docs and image fonts)
+	rm -rf "$SLACK_MATHJAX_DIR"/{docs,test,unpacked,fonts/HTML-CSS/TeX/png}
+	# Combine MathJax and the configured components into one file, so that
+	# startup reads a single file instead of requesting each component
+	for c in "${MATHJAX_COMPONENTS[@]}"; do
+		[ -e "$SLACK_MATHJAX_DIR/$c" ] || error "Cannot find MathJax component: $c"
+	done
+	PRELOADING="$(printf "'[MathJax]/%s', " "${MATHJAX_COMPONENTS[@]}")"
+	{
+		cat "$SLACK_MATHJAX_DIR/MathJax.js"
+		echo
+		echo "MathJax.Ajax.Preloading(${PRELOADING%, });"
+		for c in "${MATHJAX_COMPONENTS[@]}"; do
+			cat "$SLACK_MATHJAX_DIR/$c"
+			echo
+		done
+	} > "$SLACK_MATHJAX_DIR/MathJax-bundle.js"
+	BUNDLE_FILES=$((${#MATHJAX_COMPONENTS[@]} + 1))
+	BUNDLE_KB=$(($(wc -c < "$SLACK_MATHJAX_DIR/MathJax-bundle.js") / 1024))
+	echo "Combined $BUNDLE_FILES MathJax files into a $BUNDLE_KB KB bundle."
+	MATHJAX_URL="file://$SLACK_MATHJAX_DIR/MathJax-bundle.js"
+	MATHJAX_BUNDLED="true"
+fi
+
+
+## Install KaTeX
+
+KATEX_URL=""
+
+if [ "$ENGINE" = "katex" ]; then
+	KATEX_TMP="$(mktemp -d)"
+	if [ -z "$KATEX_ARCHIVE" ]; then
+		echo "Downloading KaTeX $KATEX_VERSION from: $KATEX_ARCHIVE_URL"
+		KATEX_ARCHIVE="$KATEX_TMP/katex.tar.gz"
+		curl -sSfL -o "$KATEX_ARCHIVE" "$KATEX_ARCHIVE_URL" || error "Cannot download KaTeX."
+	fi
+	tar -xzf "$KATEX_ARCHIVE" -C "$KATEX_TMP" || error "Cannot unpack KaTeX archive: $KATEX_ARCHIVE"
+	if [ ! -e "$KATEX_TMP/katex/katex.min.js" ]; then
+		error "Archive does not contain KaTeX: $KATEX_ARCHIVE"
+	fi
+	mv "$KATEX_TMP/katex" "$SLACK_KATEX_DIR"
+	rm -rf "$KATEX_TMP"
+	KATEX_URL="file://$SLACK_KATEX_DIR"
+	echo "Installed KaTeX $KATEX_VERSION at: $SLACK_KATEX_DIR"
+fi
+
+
 ## Write main script
 
-cat <<EOF > $SLACK_MATHJAX_SCRIPT
+# Escape the path of the timeline log for a JavaScript string
+TIMELINE_LOG_JS="${TIMELINE_LOG//\\/\\\\}"
+TIMELINE_LOG_JS="${TIMELINE_LOG_JS//\'/\\\'}"
+
+cat <<EOF > "$SLACK_MATHJAX_SCRIPT"
 // math-with-slack $MWS_VERSION
 // https://github.com/fsavje/math-with-slack
 
+var mws_version = '$MWS_VERSION';
+var mws_engine = '$ENGINE';
+var mws_mathjax_url = '$MATHJAX_URL';
+var mws_mathjax_bundled = $MATHJAX_BUNDLED;
+var mws_katex_url = '$KATEX_URL';
+var mws_worker = $WORKER;
+var mws_worker_count = $WORKER_COUNT;
+var mws_lazy_margin = $LAZY_MARGIN;
+var mws_chunk_budget = $CHUNK_BUDGET;
+var mws_max_length = $MAX_LENGTH;
+var mws_max_depth = $MAX_DEPTH;
+var mws_max_macros = $MAX_MACROS;
+var mws_timeout = $TIMEOUT;
+var mws_cache_size = $((CACHE_SIZE * 1024 * 1024));
+var mws_timeline_log = '$TIMELINE_LOG_JS';
+EOF
+
+cat <<'EOF' >> "$SLACK_MATHJAX_SCRIPT"
+
 document.addEventListener('DOMContentLoaded', function() {
-  var mathjax_config = document.createElement('script');
-  mathjax_config.type = 'text/x-mathjax-config';
-  mathjax_config.text = \`
-    MathJax.Hub.Config({
-      messageStyle: 'none',
-      extensions: ['tex2jax.js'],
-      jax: ['input/TeX', 'output/HTML-CSS'],
-      tex2jax: {
-        displayMath: [['\$\$', '\$\$']],
-        element: 'msgs_div',
-        ignoreClass: 'ql-editor',
-        inlineMath: [['\$', '\$']],
-        processEscapes: true,
-        skipTags: ['script', 'noscript', 'style', 'textarea', 'pre', 'code']
-      },
-      TeX: {
-        extensions: ['AMSmath.js', 'AMSsymbols.js', 'noErrors.js', 'noUndefined.js']
+  timeline_mark('dom-ready');
+
+  // Nodes waiting to be typeset. Mutations only add to this set; the set is
+  // flushed at most once per idle period (or animation frame), and never
+  // while a previous flush is still in MathJax's queue. Nothing is flushed
+  // before the engine has been loaded, which only happens once the first
+  // node with math is marked dirty. typesetting holds the nodes of the
+  // flush in progress.
+  var dirty_nodes = [];
+  var flush_requested = false;
+  var typesetting = null;
+  var engine_state = 'unloaded';
+
+  function mark_dirty(node) {
+    if (!node || dirty_nodes.some(function (other) { return other.contains(node); })) {
+      return;
+    }
+    dirty_nodes = dirty_nodes.filter(function (other) { return !node.contains(other); });
+    dirty_nodes.push(node);
+  }
+
+  function request_flush() {
+    if (engine_state !== 'ready') {
+      load_engine();
+      return;
+    }
+    if (flush_requested || typesetting) {
+      return;
+    }
+    flush_requested = true;
+    if (window.requestIdleCallback) {
+      window.requestIdleCallback(flush, { timeout: 200 });
+    } else {
+      window.requestAnimationFrame(flush);
+    }
+  }
+
+  // Dirty nodes are typeset in chunks, messages in view first and then the
+  // newest, so that a large backlog does not freeze the client. A chunk
+  // holds as many nodes as the engine is expected to get through within
+  // mws_chunk_budget milliseconds, judging by the time it took per node
+  // (until the engine was done with the chunk) in earlier chunks. The rest
+  // wait for the next idle period. A budget of 0 typesets everything at
+  // once. Timers are coarse and cached equations are quick, so the time per
+  // node is taken to be at least chunk_min_ms, and a chunk never holds
+  // more than chunk_max_nodes nodes.
+  var chunk_stats = { chunks: 0, ms_per_node: 0 };
+  var chunk_min_ms = 0.1;
+  var chunk_max_nodes = 100;
+
+  function in_viewport(node) {
+    var rect = node.getBoundingClientRect();
+    return rect.bottom > 0 && rect.top < window.innerHeight;
+  }
+
+  function by_priority(nodes) {
+    var newest_first = function (a, b) {
+      return a.compareDocumentPosition(b) & Node.DOCUMENT_POSITION_FOLLOWING ? 1 : -1;
+    };
+    var visible = nodes.filter(in_viewport);
+    var hidden = nodes.filter(function (node) { return visible.indexOf(node) === -1; });
+    return visible.sort(newest_first).concat(hidden.sort(newest_first));
+  }
+
+  function chunk_size(count) {
+    if (mws_chunk_budget === 0) {
+      return count;
+    }
+    if (chunk_stats.chunks === 0) {
+      return 1;
+    }
+    var ms_per_node = Math.max(chunk_min_ms, chunk_stats.ms_per_node);
+    return Math.min(chunk_max_nodes, Math.max(1, Math.floor(mws_chunk_budget / ms_per_node)));
+  }
+
+  function flush() {
+    if (engine_state !== 'ready') {
+      flush_requested = false;
+      load_engine();
+      return;
+    }
+    var root = document.getElementById('msgs_div') || document.body;
+    var nodes = by_priority(dirty_nodes.filter(function (node) { return root.contains(node); }));
+    var chunk = nodes.slice(0, chunk_size(nodes.length));
+    dirty_nodes = nodes.slice(chunk.length);
+    flush_requested = false;
+    if (chunk.length === 0) {
+      return;
+    }
+    typesetting = chunk;
+    var start = performance.now();
+    engine.typeset(chunk, function () {
+      var ms = performance.now() - start;
+      record_typeset(chunk.length, ms);
+      chunk_stats.ms_per_node = chunk_stats.chunks === 0 ? ms / chunk.length : 0.8 * chunk_stats.ms_per_node + 0.2 * ms / chunk.length;
+      chunk_stats.chunks++;
+      chunk.forEach(mark_scanned);
+      save_cache();
+      typesetting = null;
+      if (timeline_mark('first-typeset')) {
+        write_timeline();
+      }
+      if (dirty_nodes.length > 0) {
+        request_flush();
       }
     });
-  \`;
+  }
+
+  // Counters for mathWithSlack.stats() and the overlay. A typeset's render
+  // time runs from the start of the chunk until the engine is done with it,
+  // including any time spent waiting for MathJax's queue or the workers.
+  // The last 500 render times are kept for the percentile.
+  var typeset_stats = { typesets: 0, nodes: 0, equations: 0, total_ms: 0, times: [] };
+
+  function record_typeset(nodes, ms) {
+    typeset_stats.typesets++;
+    typeset_stats.nodes += nodes;
+    typeset_stats.total_ms += ms;
+    typeset_stats.times.push(ms);
+    if (typeset_stats.times.length > 500) {
+      typeset_stats.times.shift();
+    }
+  }
+
+  function percentile(values, p) {
+    if (values.length === 0) {
+      return 0;
+    }
+    var sorted = values.slice().sort(function (a, b) { return a - b; });
+    return sorted[Math.ceil(p * sorted.length) - 1];
+  }
+
+  function queue_depth() {
+    return dirty_nodes.length + (typesetting ? typesetting.length : 0);
+  }
+
+  function stats() {
+    return {
+      engine: engine_state === 'ready' ? engine.version() : null,
+      typesets: typeset_stats.typesets,
+      nodes_scanned: filter_stats.checked,
+      nodes_typeset: typeset_stats.nodes,
+      equations: typeset_stats.equations,
+      cache_hits: render_cache.hits,
+      render_ms: Math.round(typeset_stats.total_ms),
+      render_ms_p95: Math.round(percentile(typeset_stats.times, 0.95)),
+      queue: queue_depth(),
+      worker_queue: worker_pool.queue.length
+    };
+  }
+
+  // Debug overlay with the counters, toggled with Ctrl+Alt+M. It lives
+  // outside the message list, so its updates are not seen by the observer.
+  var overlay = null;
+
+  function toggle_overlay() {
+    if (overlay) {
+      window.clearInterval(overlay.timer);
+      overlay.node.remove();
+      overlay = null;
+      return;
+    }
+    var node = document.createElement('pre');
+    node.className = 'mws-overlay';
+    node.style.cssText = 'position: fixed; right: 8px; bottom: 8px; z-index: 10000; margin: 0; padding: 6px 8px; ' +
+      'background: rgba(0, 0, 0, 0.75); color: #fff; font: 11px monospace; pointer-events: none;';
+    function update() {
+      var current = stats();
+      node.textContent = Object.keys(current).map(function (name) { return name + ': ' + current[name]; }).join('\n');
+    }
+    update();
+    document.body.appendChild(node);
+    overlay = { node: node, timer: window.setInterval(update, 500) };
+  }
+
+  document.addEventListener('keydown', function (event) {
+    // AltGr is reported as Ctrl+Alt on Windows, and AltGr+M types a character
+    // on some layouts
+    if (event.ctrlKey && event.altKey && event.code === 'KeyM' && !event.getModifierState('AltGraph')) {
+      event.preventDefault();
+      toggle_overlay();
+    }
+  });
+
+  // Rendered equations keyed by TeX source, display mode and font size, in
+  // least recently used order. Cached output is cloned into new messages
+  // instead of running the TeX input jax again. Sizes are estimated from the
+  // length of the output's markup.
+  var render_cache = { entries: new Map(), bytes: 0, hits: 0, misses: 0 };
+
+  function cache_get(key) {
+    var entry = render_cache.entries.get(key);
+    if (!entry) {
+      render_cache.misses++;
+      return null;
+    }
+    if (!entry.node) {
+      var template = document.createElement('template');
+      template.innerHTML = entry.html;
+      entry.node = template.content.firstChild;
+    }
+    entry.time = Date.now();
+    render_cache.entries.delete(key);
+    render_cache.entries.set(key, entry);
+    render_cache.hits++;
+    queue_write(key, entry);
+    return entry;
+  }
+
+  function cache_insert(key, entry) {
+    if (entry.bytes > mws_cache_size) {
+      return false;
+    }
+    if (render_cache.entries.has(key)) {
+      render_cache.bytes -= render_cache.entries.get(key).bytes;
+      render_cache.entries.delete(key);
+    }
+    render_cache.entries.set(key, entry);
+    render_cache.bytes += entry.bytes;
+    while (render_cache.bytes > mws_cache_size) {
+      var oldest = render_cache.entries.keys().next().value;
+      render_cache.bytes -= render_cache.entries.get(oldest).bytes;
+      render_cache.entries.delete(oldest);
+      queue_write(oldest, null);
+    }
+    return true;
+  }
+
+  function detached_copy(output) {
+    var node = output.cloneNode(true);
+    node.removeAttribute('id');
+    Array.prototype.forEach.call(node.querySelectorAll('[id]'), function (el) {
+      el.removeAttribute('id');
+    });
+    return node;
+  }
+
+  function cache_put(key, output) {
+    var node = detached_copy(output);
+    var html = node.outerHTML;
+    var entry = { node: node, html: html, bytes: 2 * html.length, time: Date.now() };
+    if (cache_insert(key, entry)) {
+      queue_write(key, entry);
+    }
+  }
+
+  // The equations of each message as they were last rendered, by cache key.
+  // When a message is edited, its new equations are compared with these and
+  // only the ones that changed are rendered; the rest are reused from here,
+  // even if the render cache is off or has dropped them. Messages that Slack
+  // discards take their equations with them.
+  var message_equations = new WeakMap();
+  var edit_stats = { reused: 0 };
+
+  function record_output(node, key, output) {
+    var message = message_of(node);
+    if (!message) {
+      return;
+    }
+    if (!message_equations.has(message)) {
+      message_equations.set(message, new Map());
+    }
+    message_equations.get(message).set(key, detached_copy(output));
+  }
+
+  // Output for the equation with key in node that needs no rendering, from
+  // the message's previous rendering or from the render cache.
+  function known_output(node, key) {
+    var message = message_of(node);
+    var equations = message && message_equations.get(message);
+    if (equations && equations.has(key)) {
+      edit_stats.reused++;
+      return equations.get(key).cloneNode(true);
+    }
+    var entry = cache_get(key);
+    if (!entry) {
+      return null;
+    }
+    record_output(node, key, entry.node);
+    return entry.node.cloneNode(true);
+  }
+
+  // The render cache is also kept in IndexedDB so that it survives restarts.
+  // Stored equations are dropped when math-with-slack or MathJax is updated
+  // and when they have not been used for cache_max_age; the rest are loaded
+  // oldest first, so the size limit evicts the least recently used ones.
+  var cache_max_age = 30 * 24 * 60 * 60 * 1000;
+  var cache_db = null;
+  var cache_writes = new Map();
+
+  // Changes are only queued while there is a database to write them to
+  function queue_write(key, entry) {
+    if (cache_db) {
+      cache_writes.set(key, entry);
+    }
+  }
+
+  function load_cache(callback) {
+    if (mws_cache_size === 0 || !window.indexedDB) {
+      callback();
+      return;
+    }
+    var version = mws_version + '/' + engine.version();
+    var request = window.indexedDB.open('math-with-slack', 1);
+    request.onupgradeneeded = function () {
+      request.result.createObjectStore('meta');
+      request.result.createObjectStore('equations');
+    };
+    request.onerror = function () { callback(); };
+    request.onsuccess = function () {
+      var db = request.result;
+      var stored = [];
+      var stored_bad = [];
+      var tx = db.transaction(['meta', 'equations'], 'readwrite');
+      var equations = tx.objectStore('equations');
+      tx.objectStore('meta').get('version').onsuccess = function (event) {
+        if (event.target.result !== version) {
+          equations.clear();
+          tx.objectStore('meta').delete('bad_tex');
+          tx.objectStore('meta').put(version, 'version');
+          return;
+        }
+        tx.objectStore('meta').get('bad_tex').onsuccess = function (event) {
+          stored_bad = event.target.result || [];
+        };
+        equations.openCursor().onsuccess = function (event) {
+          var cursor = event.target.result;
+          if (!cursor) {
+            return;
+          }
+          if (Date.now() - cursor.value.time > cache_max_age) {
+            cursor.delete();
+          } else {
+            stored.push({ key: cursor.key, value: cursor.value });
+          }
+          cursor.continue();
+        };
+      };
+      tx.oncomplete = function () {
+        cache_db = db;
+        stored.sort(function (a, b) { return a.value.time - b.value.time; });
+        stored.forEach(function (item) {
+          var html = item.value.html;
+          cache_insert(item.key, { node: null, html: html, bytes: 2 * html.length, time: item.value.time });
+        });
+        bad_tex.hashes = new Set(stored_bad.concat(Array.from(bad_tex.hashes)));
+        save_cache();
+        callback();
+      };
+      tx.onabort = function () { callback(); };
+    };
+  }
+
+  function save_cache() {
+    if (!cache_db) {
+      return;
+    }
+    if (bad_tex.changed) {
+      cache_db.transaction('meta', 'readwrite').objectStore('meta').put(Array.from(bad_tex.hashes), 'bad_tex');
+      bad_tex.changed = false;
+    }
+    if (cache_writes.size === 0) {
+      return;
+    }
+    var equations = cache_db.transaction('equations', 'readwrite').objectStore('equations');
+    cache_writes.forEach(function (entry, key) {
+      if (entry) {
+        equations.put({ html: entry.html, time: entry.time }, key);
+      } else {
+        equations.delete(key);
+      }
+    });
+    cache_writes.clear();
+  }
+
+  // TeX that failed to parse, by a hash of its source and display mode. Such
+  // equations are shown as raw TeX when they show up again instead of being
+  // parsed once more, which matters for messages full of dollar signs that
+  // are not math. The most recent bad_tex.limit hashes are kept, and stored
+  // with the render cache; like the cache, they are dropped when
+  // math-with-slack or the engine changes.
+  var bad_tex = { hashes: new Set(), limit: 1000, changed: false };
+
+  function bad_tex_hash(tex, display) {
+    return text_hash((display ? '$$' : '$') + tex);
+  }
+
+  function is_bad_tex(tex, display) {
+    return bad_tex.hashes.has(bad_tex_hash(tex, display));
+  }
+
+  function add_bad_tex(tex, display) {
+    var hash = bad_tex_hash(tex, display);
+    bad_tex.hashes.delete(hash);
+    bad_tex.hashes.add(hash);
+    if (bad_tex.hashes.size > bad_tex.limit) {
+      bad_tex.hashes.delete(bad_tex.hashes.values().next().value);
+    }
+    bad_tex.changed = true;
+  }
+
+  // MathJax 2 is handed the math as math/tex scripts, which is what tex2jax
+  // would have made of it. Equations found in the cache get their output
+  // instead, and equations over the limits or known to be bad TeX their raw
+  // TeX. The scripts are remembered so that their output can be cached once
+  // MathJax has rendered them, unless it turns out they could not be parsed.
+  function math_script(segment) {
+    var script = document.createElement('script');
+    script.type = segment.display ? 'math/tex; mode=display' : 'math/tex';
+    script.text = segment.tex;
+    return script;
+  }
+
+  function mathjax2_output(segment, node, pending) {
+    var script = math_script(segment);
+    var key = [script.type, window.getComputedStyle(node).fontSize, segment.tex].join('\n');
+    var output = known_output(node, key);
+    if (output) {
+      return output;
+    }
+    if (too_complex(segment.tex) || is_bad_tex(segment.tex, segment.display)) {
+      return raw_output(segment.source);
+    }
+    pending.push({ script: script, key: key, display: segment.display });
+    return script;
+  }
+
+  function fill_cache(pending) {
+    pending.forEach(function (item) {
+      var jax = MathJax.Hub.getJaxFor(item.script);
+      if (jax && jax.root && jax.root.texError) {
+        add_bad_tex(jax.originalText, item.display);
+        return;
+      }
+      var frame = jax && document.getElementById(jax.inputID + '-Frame');
+      if (frame) {
+        var output = frame.parentNode.className === 'MathJax_Display' ? frame.parentNode : frame;
+        cache_put(item.key, output);
+        record_output(item.script, item.key, output);
+      }
+    });
+  }
+
+  // Cheap check run before a node is handed to the engine: most messages
+  // contain no unescaped dollar sign outside the skipped tags and classes,
+  // and those never need to be scanned. Messages with dollar signs are
+  // scanned for math the way scan_math() does it, so that messages that
+  // only mention prices never reach the engine either.
+  var skip_tags = ['script', 'noscript', 'style', 'textarea', 'pre', 'code'];
+  var ignore_classes = ['ql-editor', 'katex', 'MathJax', 'MathJax_Display', 'MathJax_Preview', 'mws-raw'];
+  var skip_selector = skip_tags.concat(ignore_classes.map(function (c) { return '.' + c; })).join(', ');
+  var filter_stats = { checked: 0, rejected: 0, unchanged: 0, ignored: 0 };
+
+  function text_walker(node) {
+    return document.createTreeWalker(node, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, {
+      acceptNode: function (n) {
+        if (n.nodeType === Node.TEXT_NODE) {
+          return NodeFilter.FILTER_ACCEPT;
+        }
+        return n.matches(skip_selector) ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_SKIP;
+      }
+    });
+  }
+
+  // Slack shows the line breaks in a message as <br> elements. As with
+  // tex2jax, math may run across them (and across comments), so text is
+  // scanned in runs of adjacent text nodes, line breaks and comments, with
+  // each line break standing in for whitespace. A run ends at its last text
+  // node.
+  var line_break = '\u2028';
+
+  function joins_run(node) {
+    return node.nodeType === Node.TEXT_NODE || node.nodeType === Node.COMMENT_NODE ||
+      node.nodeName === 'BR' || node.nodeName === 'WBR';
+  }
+
+  function text_runs(node) {
+    var runs = [];
+    var in_run = new Set();
+    var walker = text_walker(node);
+    while (walker.nextNode()) {
+      if (in_run.has(walker.currentNode)) {
+        continue;
+      }
+      var run = [];
+      var between = [];
+      for (var n = walker.currentNode; n && joins_run(n); n = n.nextSibling) {
+        between.push(n);
+        if (n.nodeType === Node.TEXT_NODE) {
+          in_run.add(n);
+          run = run.concat(between);
+          between = [];
+        }
+      }
+      runs.push({
+        nodes: run,
+        text: run.map(function (n) {
+          return n.nodeType === Node.TEXT_NODE ? n.data : n.nodeName === 'BR' ? line_break : '';
+        }).join('')
+      });
+    }
+    return runs;
+  }
+
+  // The math in a run, with its line breaks turned into newlines
+  function scan_run(run) {
+    return scan_math(run.text).map(function (segment) {
+      if ('tex' in segment) {
+        segment.tex = segment.tex.split(line_break).join('\n');
+        segment.source = segment.source.split(line_break).join('\n');
+      }
+      return segment;
+    });
+  }
+
+  function has_math(node) {
+    if (node.textContent.indexOf('$') === -1 || node.closest(skip_selector)) {
+      return false;
+    }
+    return text_runs(node).some(function (run) {
+      return scan_math(run.text).some(function (segment) { return 'tex' in segment; });
+    });
+  }
+
+  // Candidates are checked message by message. Once a message has been
+  // scanned (and typeset, if it had math) it is tagged with a hash of its
+  // text, and it is not scanned again while its text hashes the same, however
+  // often Slack touches it.
+  var message_selector = 'ts-message, .c-virtual_list__item, .c-message';
 
-  var mathjax_observer = document.createElement('script');
-  mathjax_observer.type = 'text/x-mathjax-config';
-  mathjax_observer.text = \`
+  // Messages nest (Slack's list items hold the message proper), so the
+  // messages of a node are always the innermost ones at or around it. They
+  // are what gets tagged, typeset and keyed by, however Slack added them.
+  function messages_in(node) {
+    var root = node.closest(message_selector) || node;
+    var messages = Array.prototype.filter.call(root.querySelectorAll(message_selector), function (m) {
+      return m.querySelector(message_selector) === null;
+    });
+    return messages.length > 0 ? messages : [root];
+  }
+
+  function message_of(node) {
+    var messages = messages_in(node);
+    return messages.length === 1 && messages[0].matches(message_selector) ? messages[0] : null;
+  }
+
+  function text_hash(text) {
+    var hash = 0x811c9dc5;
+    for (var i = 0; i < text.length; i++) {
+      hash = Math.imul(hash ^ text.charCodeAt(i), 0x01000193);
+    }
+    return (hash >>> 0).toString(36);
+  }
+
+  function mark_scanned(node) {
+    messages_in(node).forEach(function (message) {
+      message.dataset.mwsHash = text_hash(message.textContent);
+    });
+  }
+
+  // With --lazy, messages are registered with an IntersectionObserver and
+  // only marked dirty once they come within mws_lazy_margin of the visible
+  // part of the message list. The margin applies to the element that
+  // scrolls the list, the nearest scrolling element at or above the list.
+  var viewport_observer = null;
+
+  function scroll_parent(node) {
+    for (var el = node; el && el !== document.body; el = el.parentElement) {
+      var overflow = window.getComputedStyle(el).overflowY;
+      if (overflow === 'auto' || overflow === 'scroll') {
+        return el;
+      }
+    }
+    return null;
+  }
+
+  function start_viewport_observer(target) {
+    var list = document.getElementById('msgs_div') || target;
+    viewport_observer = new IntersectionObserver(function (entries) {
+      entries.forEach(function (entry) {
+        if (entry.isIntersecting) {
+          viewport_observer.unobserve(entry.target);
+          mark_dirty(entry.target);
+        }
+      });
+      if (dirty_nodes.length > 0) {
+        request_flush();
+      }
+    }, { root: scroll_parent(list), rootMargin: mws_lazy_margin });
+    add_candidate(list);
+  }
+
+  function add_candidate(node) {
+    if (!node) {
+      return;
+    }
+    messages_in(node).forEach(function (message) {
+      filter_stats.checked++;
+      var hash = text_hash(message.textContent);
+      if (message.dataset.mwsHash === hash) {
+        filter_stats.unchanged++;
+      } else if (!has_math(message)) {
+        message.dataset.mwsHash = hash;
+        filter_stats.rejected++;
+      } else if (viewport_observer) {
+        viewport_observer.observe(message);
+      } else {
+        mark_dirty(message);
+      }
+    });
+  }
+
+  // The engines' own changes to the messages are not candidates: rendered
+  // equations (and MathJax's script tags) are among the skipped tags and
+  // classes. Changes made by render_math() are never seen at all (see
+  // quietly), so any other change to the text of a message, even one that
+  // is being typeset, is Slack's and makes the message dirty again.
+  function engine_mutation(node) {
+    var element = node.nodeType === Node.ELEMENT_NODE ? node : node.parentElement;
+    return element !== null && element.closest(skip_selector) !== null;
+  }
+
+  function handle_records(records) {
+    records.forEach(function (record) {
+      var nodes = record.type === 'characterData' ? [record.target] : Array.prototype.slice.call(record.addedNodes);
+      nodes.forEach(function (node) {
+        if (engine_mutation(node)) {
+          filter_stats.ignored++;
+        } else {
+          add_candidate(node.nodeType === Node.ELEMENT_NODE ? node : node.parentNode);
+        }
+      });
+    });
+    if (dirty_nodes.length > 0) {
+      request_flush();
+    }
+  }
+
+  var observer = new MutationObserver(handle_records);
+
+  // Makes a change to the messages without the observer reacting to it.
+  // Mutation records are delivered after every task, so the observer's
+  // queue only holds those of the current task: they are handled first, and
+  // the records of the change itself are dropped.
+  function quietly(change) {
+    handle_records(observer.takeRecords());
+    change();
+    observer.takeRecords();
+  }
+
+  // Inline math that is more likely to be prices, after Pandoc's rules: the
+  // TeX may not start or end with whitespace, the closing dollar sign may
+  // not be followed by a digit, and TeX that starts with a digit may not
+  // contain whitespace. Prices such as $5 and $10, or $5-$10, are not math,
+  // while $x$, $2^n$ and $5$ still are.
+  function currency_like(tex, after) {
+    return /^\s|\s$/.test(tex) || /^[0-9]/.test(after || '') || (/^[0-9]/.test(tex) && /\s/.test(tex));
+  }
+
+  // Splits text into plain text and math the way tex2jax does: $$...$$ is
+  // display math, $...$ inline math and \$ an escaped dollar sign. Inline
+  // math that looks like prices (see currency_like) is left as text, and
+  // its closing dollar sign may open the next equation.
+  function scan_math(text) {
+    var segments = [];
+    var plain = '';
+    var i = 0;
+    var open;
+    while ((open = text.indexOf('$', i)) !== -1) {
+      if (text[open - 1] === '\\') {
+        plain += text.slice(i, open - 1) + '$';
+        i = open + 1;
+        continue;
+      }
+      var delimiter = text[open + 1] === '$' ? '$$' : '$';
+      var close = find_closing(text, open + delimiter.length, delimiter);
+      if (close === -1) {
+        plain += text.slice(i, open + delimiter.length);
+        i = open + delimiter.length;
+        continue;
+      }
+      if (delimiter === '$' && currency_like(text.slice(open + 1, close), text[close + 1])) {
+        plain += text.slice(i, close);
+        i = close;
+        continue;
+      }
+      plain += text.slice(i, open);
+      if (plain) {
+        segments.push({ text: plain });
+        plain = '';
+      }
+      segments.push({
+        tex: text.slice(open + delimiter.length, close),
+        display: delimiter === '$$',
+        source: text.slice(open, close + delimiter.length)
+      });
+      i = close + delimiter.length;
+    }
+    plain += text.slice(i);
+    if (plain) {
+      segments.push({ text: plain });
+    }
+    return segments;
+  }
+
+  function find_closing(text, from, delimiter) {
+    for (var j = from; j < text.length; j++) {
+      if (text[j] === '\\') {
+        j++;
+      } else if (text.startsWith(delimiter, j)) {
+        return j > from ? j : -1;
+      }
+    }
+    return -1;
+  }
+
+  // Limits on the equations that are rendered, so that a single pathological
+  // equation cannot freeze the client. Equations that are too long or too
+  // deeply nested (braces, \left...\right and environments) are shown as
+  // raw TeX without reaching the engine, and macro expansion is capped by
+  // the engines themselves. Equations that took longer than mws_timeout to
+  // render are remembered and shown as raw TeX from then on; in workers,
+  // rendering is also stopped when the time is up. MathJax 2 renders the
+  // equations of a chunk together in its queue, so they cannot be timed one
+  // by one and mws_timeout does not apply to it. A limit of 0 is no limit.
+  var slow_equations = new Set();
+  var tex_command = /\\([a-zA-Z]*)/g;
+
+  function too_complex(tex) {
+    if (mws_max_length > 0 && tex.length > mws_max_length) {
+      return true;
+    }
+    var depth = 0;
+    for (var i = 0; i < tex.length; i++) {
+      var opens = tex[i] === '{';
+      var closes = tex[i] === '}';
+      if (tex[i] === '\\') {
+        tex_command.lastIndex = i;
+        var name = tex_command.exec(tex)[1];
+        opens = name === 'left' || name === 'begin';
+        closes = name === 'right' || name === 'end';
+        i += Math.max(name.length, 1);
+      }
+      if (opens) {
+        depth++;
+      } else if (closes) {
+        depth--;
+      }
+      if (mws_max_depth > 0 && depth > mws_max_depth) {
+        return true;
+      }
+    }
+    return false;
+  }
+
+  function over_limits(key, tex) {
+    return slow_equations.has(key) || too_complex(tex);
+  }
+
+  function check_time(key, start) {
+    if (mws_timeout > 0 && performance.now() - start > mws_timeout) {
+      console.warn('math-with-slack: equation took more than ' + mws_timeout + ' ms, it will be shown as TeX');
+      slow_equations.add(key);
+    }
+  }
+
+  function raw_output(source) {
+    var span = document.createElement('span');
+    span.className = 'mws-raw';
+    span.textContent = source;
+    return span;
+  }
+
+  // The tokenizer that finds the math for every engine. Each message's text
+  // is walked once, skipping the skipped tags and classes, and every run of
+  // text (see text_runs) with math is replaced by its plain text, line
+  // breaks and the equations' output in a single step, without splitting
+  // nodes first. render(segment, callback, node) passes the output for one
+  // equation in node, or null if it cannot be rendered, to callback,
+  // possibly asynchronously. A run with an equation that cannot be rendered
+  // is left untouched (escapes included); done() is called with the nodes
+  // that contain such runs once every equation has been rendered.
+  function plain_output(text) {
+    var fragment = document.createDocumentFragment();
+    text.split(line_break).forEach(function (line, i) {
+      if (i > 0) {
+        fragment.appendChild(document.createElement('br'));
+      }
+      if (line) {
+        fragment.appendChild(document.createTextNode(line));
+      }
+    });
+    return fragment;
+  }
+
+  // Slack may have changed a run while its equations were being rendered
+  function in_place(nodes) {
+    var parent = nodes[0].parentNode;
+    return parent !== null && nodes.every(function (n) { return n.parentNode === parent; });
+  }
+
+  function render_math(nodes, render, done) {
+    var failed = [];
+    var waiting = 1;
+    function finish() {
+      if (--waiting === 0) {
+        done(failed);
+      }
+    }
+    nodes.forEach(function (node) {
+      text_runs(node).forEach(function (run) {
+        var segments = scan_run(run);
+        var remaining = segments.filter(function (segment) { return 'tex' in segment; }).length;
+        if (remaining === 0) {
+          return;
+        }
+        var rendered = true;
+        var outputs = segments.map(function (segment) {
+          return 'tex' in segment ? null : plain_output(segment.text);
+        });
+        waiting++;
+        segments.forEach(function (segment, i) {
+          if (!('tex' in segment)) {
+            return;
+          }
+          render(segment, function (output) {
+            if (output !== null && typesetting) {
+              typeset_stats.equations++;
+            }
+            outputs[i] = output;
+            rendered = rendered && output !== null;
+            if (--remaining > 0) {
+              return;
+            }
+            if (!rendered) {
+              if (failed.indexOf(node) === -1) {
+                failed.push(node);
+              }
+            } else if (in_place(run.nodes)) {
+              var fragment = document.createDocumentFragment();
+              outputs.forEach(function (output) { fragment.appendChild(output); });
+              quietly(function () {
+                run.nodes[0].parentNode.insertBefore(fragment, run.nodes[0]);
+                run.nodes.forEach(function (n) { n.parentNode.removeChild(n); });
+              });
+            }
+            finish();
+          }, node);
+        });
+      });
+    });
+    finish();
+  }
+
+  function katex_output(segment, node) {
+    var key = ['katex', segment.display, segment.tex].join('\n');
+    var output = known_output(node, key);
+    if (output) {
+      return output;
+    }
+    if (over_limits(key, segment.tex) || is_bad_tex(segment.tex, segment.display)) {
+      return raw_output(segment.source);
+    }
+    var template = document.createElement('template');
+    var start = performance.now();
+    try {
+      template.innerHTML = katex.renderToString(segment.tex, {
+        displayMode: segment.display,
+        maxExpand: mws_max_macros,
+        throwOnError: true
+      });
+    } catch (err) {
+      return null;
+    }
+    check_time(key, start);
+    cache_put(key, template.content.firstChild);
+    record_output(node, key, template.content.firstChild);
+    return template.content.firstChild;
+  }
+
+  // MathJax 3 on the main thread converts one equation at a time, and its
+  // CHTML stylesheet is brought up to date once a chunk is done. Its output
+  // is not cached, since it relies on the rules in that stylesheet.
+  function mathjax3_output(segment, callback) {
+    var key = ['chtml', segment.display, segment.tex].join('\n');
+    if (over_limits(key, segment.tex) || is_bad_tex(segment.tex, segment.display)) {
+      callback(raw_output(segment.source));
+      return;
+    }
+    var start = performance.now();
+    MathJax.texReset();
+    var promise = MathJax.tex2chtmlPromise(segment.tex, { display: segment.display });
+    check_time(key, start);
+    promise.then(function (output) {
+      if (output.querySelector('[data-mjx-error]')) {
+        add_bad_tex(segment.tex, segment.display);
+        output = raw_output(segment.source);
+      }
+      callback(output);
+    }).catch(function (err) {
+      console.error('math-with-slack: ' + err.message);
+      callback(null);
+    });
+  }
+
+  // Nodes with math that KaTeX cannot render are typeset by MathJax 2,
+  // which is only loaded the first time this happens.
+  var fallback = { state: 'unloaded', nodes: [] };
+
+  function typeset_fallback(nodes) {
+    fallback.nodes = fallback.nodes.concat(nodes);
+    if (fallback.state === 'unloaded') {
+      fallback.state = 'loading';
+      engines.mathjax2.load(function () {
+        fallback.state = 'ready';
+        typeset_fallback([]);
+      });
+    } else if (fallback.state === 'ready' && fallback.nodes.length > 0) {
+      var pending = fallback.nodes;
+      fallback.nodes = [];
+      engines.mathjax2.typeset(pending, save_cache);
+    }
+  }
+
+  // With --worker, TeX is rendered to SVG markup by MathJax 3 in a pool of
+  // Web Workers, using its DOM-less lite adaptor; the main thread only swaps
+  // the markup in. worker_main() is the workers' source. Local MathJax files
+  // are handed to the workers as blob URLs, since a worker cannot load file
+  // URLs.
+  function worker_main() {
+    var files = {};
+    self.onmessage = function (event) {
+      var message = event.data;
+      if (message.type === 'init') {
+        files = message.files;
+        self.MathJax = {
+          loader: {
+            load: ['adaptors/liteDOM', '[tex]/noerrors'],
+            paths: { mathjax: message.root },
+            require: function (url) { importScripts(files[url] || url); }
+          },
+          tex: {
+            packages: { '[+]': ['noerrors'] },
+            maxMacros: message.max_macros
+          },
+          svg: {
+            fontCache: 'none'
+          },
+          startup: {
+            adaptor: 'liteAdaptor',
+            typeset: false,
+            ready: function () {
+              MathJax.startup.defaultReady();
+              MathJax.startup.promise.then(function () {
+                self.postMessage({ type: 'ready', version: MathJax.version });
+              });
+            }
+          }
+        };
+        importScripts(files[message.main] || message.main);
+      } else if (message.type === 'render') {
+        MathJax.tex2svgPromise(message.tex, { display: message.display }).then(function (node) {
+          var html = MathJax.startup.adaptor.outerHTML(node);
+          self.postMessage({ type: 'result', html: html, bad: html.indexOf('data-mjx-error') !== -1 });
+        }).catch(function (err) {
+          self.postMessage({ type: 'result', error: err.message });
+        });
+      }
+    };
+  }
+
+  // Each worker renders one equation at a time. Equations wait in a queue
+  // ordered by priority (lower first, then in the order they were asked
+  // for), so that messages in view are rendered before the backlog of a
+  // channel that was just opened. An equation that is already waiting is
+  // not queued twice.
+  var worker_pool = {
+    workers: [], starting: 0, queue: [], waiting: new Map(),
+    version: null, ready: null, fail: null, url: null, init: null
+  };
+
+  // Local files are read with Node's fs, which Slack's loader leaves in
+  // scope, and outside Slack (in benchmark/) with a synchronous request.
+  function read_file(url) {
+    if (typeof require === 'function') {
+      return require('fs').readFileSync(require('url').fileURLToPath(url));
+    }
+    var request = new XMLHttpRequest();
+    request.open('GET', url, false);
+    request.send();
+    if (!request.responseText) {
+      throw new Error('cannot read ' + url);
+    }
+    return request.responseText;
+  }
+
+  function start_workers(ready, fail) {
+    var root = mws_mathjax_url.replace(/\/[^\/]*$/, '');
+    var main = root + '/tex-svg.js';
+    var files = {};
+    var count = mws_worker_count || Math.max(1, (navigator.hardwareConcurrency || 2) - 1);
+    var reason = null;
+    worker_pool.ready = ready;
+    worker_pool.fail = fail;
+    try {
+      if (root.indexOf('file:') === 0) {
+        [main, root + '/adaptors/liteDOM.js', root + '/input/tex/extensions/noerrors.js'].forEach(function (file) {
+          files[file] = URL.createObjectURL(new Blob([read_file(file)], { type: 'text/javascript' }));
+        });
+      }
+      var source = '(' + worker_main.toString() + ')();';
+      worker_pool.url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }));
+      worker_pool.init = { type: 'init', root: root, main: main, files: files, max_macros: mws_max_macros };
+      for (var i = 0; i < count; i++) {
+        start_worker();
+      }
+    } catch (err) {
+      reason = err.message;
+    }
+    if (worker_pool.starting === 0) {
+      fail(reason);
+    }
+  }
+
+  function start_worker() {
+    var entry = { worker: new Worker(worker_pool.url), job: null, timer: null };
+    worker_pool.starting++;
+    entry.worker.onmessage = function (event) {
+      var message = event.data;
+      if (message.type === 'ready') {
+        worker_pool.starting--;
+        worker_pool.workers.push(entry);
+        if (worker_pool.version === null) {
+          worker_pool.version = message.version;
+          worker_pool.ready();
+        }
+        worker_dispatch();
+      } else if (message.type === 'result') {
+        var job = entry.job;
+        window.clearTimeout(entry.timer);
+        entry.job = null;
+        job.done(message);
+        worker_dispatch();
+      }
+    };
+    entry.worker.onerror = function (event) {
+      event.preventDefault();
+      window.clearTimeout(entry.timer);
+      entry.worker.terminate();
+      var index = worker_pool.workers.indexOf(entry);
+      if (index === -1) {
+        worker_pool.starting--;
+      } else {
+        worker_pool.workers.splice(index, 1);
+      }
+      if (entry.job) {
+        entry.job.done({ error: event.message });
+        entry.job = null;
+      }
+      worker_stopped(event.message);
+    };
+    entry.worker.postMessage(worker_pool.init);
+  }
+
+  // A worker that is still rendering when mws_timeout is up is replaced by
+  // a new one, and its equation is shown as raw TeX.
+  function worker_timeout(entry) {
+    entry.worker.terminate();
+    worker_pool.workers.splice(worker_pool.workers.indexOf(entry), 1);
+    slow_equations.add(entry.job.key);
+    console.warn('math-with-slack: equation took more than ' + mws_timeout + ' ms, it will be shown as TeX');
+    entry.job.done({ timeout: true });
+    try {
+      start_worker();
+    } catch (err) {
+      worker_stopped(err.message);
+    }
+    worker_dispatch();
+  }
+
+  // Called when a worker fails. Once none are left, waiting equations are
+  // given up on and math is typeset on the main thread from then on.
+  function worker_stopped(reason) {
+    if (worker_pool.workers.length > 0 || worker_pool.starting > 0) {
+      return;
+    }
+    // The engine is switched before the queued jobs are ended, since ending
+    // them can end the chunk and flush the next one
+    var queue = worker_pool.queue;
+    worker_pool.queue = [];
+    if (worker_pool.version !== null) {
+      console.warn('math-with-slack: workers stopped (' + reason + ')');
+      engine = engines.mathjax3;
+      engine_state = 'unloaded';
+    }
+    queue.forEach(function (job) { job.done({ error: reason }); });
+    if (worker_pool.version === null) {
+      worker_pool.fail(reason);
+    }
+  }
+
+  function worker_dispatch() {
+    worker_pool.workers.forEach(function (entry) {
+      if (!entry.job && worker_pool.queue.length > 0) {
+        entry.job = worker_pool.queue.shift();
+        entry.worker.postMessage({ type: 'render', tex: entry.job.tex, display: entry.job.display });
+        if (mws_timeout > 0) {
+          entry.timer = window.setTimeout(worker_timeout, mws_timeout, entry);
+        }
+      }
+    });
+  }
+
+  function worker_output(segment, callback, priority, node) {
+    var key = ['svg', segment.display, segment.tex].join('\n');
+    var output = known_output(node, key);
+    if (output) {
+      callback(output);
+      return;
+    }
+    if (over_limits(key, segment.tex) || is_bad_tex(segment.tex, segment.display)) {
+      callback(raw_output(segment.source));
+      return;
+    }
+    if (worker_pool.workers.length === 0 && worker_pool.starting === 0) {
+      callback(null);
+      return;
+    }
+    var rendered = function (output) {
+      if (output) {
+        record_output(node, key, output);
+      }
+      callback(output);
+    };
+    if (worker_pool.waiting.has(key)) {
+      worker_pool.waiting.get(key).callbacks.push(rendered);
+      return;
+    }
+    var job = { key: key, tex: segment.tex, display: segment.display, priority: priority, callbacks: [rendered] };
+    job.done = function (result) {
+      worker_pool.waiting.delete(key);
+      if (result.bad) {
+        add_bad_tex(segment.tex, segment.display);
+      }
+      if (result.timeout || result.bad) {
+        job.callbacks.forEach(function (callback) { callback(raw_output(segment.source)); });
+        return;
+      }
+      var template = document.createElement('template');
+      if (result.error === undefined) {
+        template.innerHTML = result.html;
+        cache_put(key, template.content.firstChild);
+      }
+      job.callbacks.forEach(function (callback) {
+        callback(result.error === undefined ? template.content.firstChild.cloneNode(true) : null);
+      });
+    };
+    var i = worker_pool.queue.length;
+    while (i > 0 && worker_pool.queue[i - 1].priority > priority) {
+      i--;
+    }
+    worker_pool.queue.splice(i, 0, job);
+    worker_pool.waiting.set(key, job);
+    worker_dispatch();
+  }
+
+  function load_script(url, onload) {
+    var script = document.createElement('script');
+    script.type = 'text/javascript';
+    script.src = url;
+    script.onload = onload;
+    document.head.appendChild(script);
+  }
+
+  function load_engine() {
+    if (engine_state !== 'unloaded') {
+      return;
+    }
+    engine_state = 'loading';
+    var requested = performance.now();
+    timeline_mark('engine-load');
+    engine.load(function () {
+      timeline_mark('engine-ready');
+      console.info('math-with-slack: ' + engine.version() + ' started in ' + Math.round(performance.now() - requested) + ' ms');
+      load_cache(function () {
+        engine_state = 'ready';
+        request_flush();
+      });
+    });
+  }
+
+  // Startup timeline. The loader in ssb-interop.js marks when it starts
+  // reading this file and when it has read it, and the payload when it has
+  // been evaluated, when the DOM is ready, when it starts observing the
+  // message list, when the engine is requested and ready, and when the
+  // first typeset is done. Phases are recorded once each, as performance
+  // marks named mws-*, and are appended to mws_timeline_log (if set) as a
+  // line of JSON after the first typeset.
+  var timeline_phases = ['loader', 'read', 'eval', 'dom-ready', 'observing', 'engine-load', 'engine-ready', 'first-typeset'];
+
+  function timeline_mark(phase) {
+    if (performance.getEntriesByName('mws-' + phase, 'mark').length > 0) {
+      return false;
+    }
+    performance.mark('mws-' + phase);
+    return true;
+  }
+
+  // Milliseconds since the client started, and since the previous phase
+  function timeline() {
+    var previous = 0;
+    return timeline_phases.map(function (phase) {
+      var mark = performance.getEntriesByName('mws-' + phase, 'mark')[0];
+      if (!mark) {
+        return null;
+      }
+      var entry = { phase: phase, ms: Math.round(mark.startTime * 10) / 10, delta: Math.round((mark.startTime - previous) * 10) / 10 };
+      previous = mark.startTime;
+      return entry;
+    }).filter(function (entry) { return entry !== null; });
+  }
+
+  function write_timeline() {
+    if (!mws_timeline_log || typeof require !== 'function') {
+      return;
+    }
+    var line = JSON.stringify({ date: new Date().toISOString(), version: mws_version, engine: engine.version(), timeline: timeline() });
+    require('fs').appendFile(mws_timeline_log, line + '\n', function (error) {
+      if (error) {
+        console.warn('math-with-slack: cannot write the timeline to ' + mws_timeline_log + ' (' + error.message + ')');
+      }
+    });
+  }
+
+  // Only the observer and the pre-filter run at startup. The message list
+  // is created by Slack's own scripts, so it is polled for until it exists.
+  function observe_messages() {
     var target = document.querySelector('#messages_container');
+    if (!target) {
+      window.setTimeout(observe_messages, 500);
+      return;
+    }
     var options = { attributes: false, childList: true, characterData: true, subtree: true };
-    var observer = new MutationObserver(function (r, o) { MathJax.Hub.Queue(['Typeset', MathJax.Hub]); });
     observer.observe(target, options);
-  \`;
+    timeline_mark('observing');
+    if (mws_lazy_margin !== null) {
+      start_viewport_observer(target);
+    } else {
+      add_candidate(document.getElementById('msgs_div') || target);
+      if (dirty_nodes.length > 0) {
+        request_flush();
+      }
+    }
+  }
 
-  var mathjax_script = document.createElement('script');
-  mathjax_script.type = 'text/javascript';
-  mathjax_script.src = 'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJax.js';
+  // The engines --engine chooses from. load() loads the engine and calls
+  // ready() once it can typeset; typeset() renders the math in an array of
+  // nodes and then calls done(). All engines find math with render_math(),
+  // and use the same TeX extensions.
+  var engines = {
+    mathjax2: {
+      // MathJax is told where the rest of its files are, since the bundle is
+      // not called MathJax.js, and to hold startup until the bundle has
+      // fully loaded.
+      load: function (ready) {
+        window.MathJax = {
+          root: mws_mathjax_url.replace(/\/[^\/]*$/, ''),
+          delayStartupUntil: mws_mathjax_bundled ? 'configured' : 'none',
+          messageStyle: 'none',
+          skipStartupTypeset: true,
+          jax: ['input/TeX', 'output/HTML-CSS'],
+          TeX: {
+            extensions: ['AMSmath.js', 'AMSsymbols.js', 'noErrors.js', 'noUndefined.js'],
+            MAXMACROS: mws_max_macros
+          },
+          'HTML-CSS': {
+            imageFont: null
+          },
+          AuthorInit: function () {
+            MathJax.Hub.Register.StartupHook('End', ready);
+          }
+        };
+        load_script(mws_mathjax_url, function () {
+          if (mws_mathjax_bundled) {
+            MathJax.Hub.Configured();
+          }
+        });
+      },
+      version: function () {
+        return 'MathJax ' + MathJax.version;
+      },
+      typeset: function (nodes, done) {
+        var pending = [];
+        render_math(nodes, function (segment, callback, node) {
+          callback(mathjax2_output(segment, node, pending));
+        }, function () {
+          MathJax.Hub.Queue(['Process', MathJax.Hub, nodes], function () {
+            fill_cache(pending);
+            done();
+          });
+        });
+      }
+    },
+    mathjax3: {
+      load: function (ready) {
+        window.MathJax = {
+          loader: {
+            load: ['[tex]/noerrors']
+          },
+          tex: {
+            packages: { '[+]': ['noerrors'] },
+            maxMacros: mws_max_macros
+          },
+          startup: {
+            typeset: false,
+            ready: function () {
+              MathJax.startup.defaultReady();
+              MathJax.startup.promise.then(ready);
+            }
+          }
+        };
+        load_script(mws_mathjax_url);
+      },
+      version: function () {
+        return 'MathJax ' + MathJax.version;
+      },
+      typeset: function (nodes, done) {
+        render_math(nodes, mathjax3_output, function () {
+          MathJax.startup.document.clear();
+          MathJax.startup.document.updateDocument();
+          done();
+        });
+      }
+    },
+    katex: {
+      load: function (ready) {
+        var stylesheet = document.createElement('link');
+        stylesheet.rel = 'stylesheet';
+        stylesheet.href = mws_katex_url + '/katex.min.css';
+        document.head.appendChild(stylesheet);
+        load_script(mws_katex_url + '/katex.min.js', ready);
+      },
+      version: function () {
+        return 'KaTeX ' + katex.version;
+      },
+      typeset: function (nodes, done) {
+        render_math(nodes, function (segment, callback, node) {
+          callback(katex_output(segment, node));
+        }, function (failed) {
+          if (failed.length > 0) {
+            typeset_fallback(failed);
+          }
+          done();
+        });
+      }
+    },
+    // Renders with MathJax 3 in workers (see worker_main), or on the main
+    // thread if no worker can be started. Equations in messages that are in
+    // view go first.
+    worker: {
+      load: function (ready) {
+        var style = document.createElement('style');
+        style.textContent = 'mjx-container[jax=SVG] { direction: ltr; }' +
+          ' mjx-container[jax=SVG][display=true] { display: block; text-align: center; margin: 1em 0; }';
+        document.head.appendChild(style);
+        start_workers(ready, function (reason) {
+          console.warn('math-with-slack: cannot start workers (' + reason + '), typesetting on the main thread');
+          engine = engines.mathjax3;
+          engine.load(ready);
+        });
+      },
+      version: function () {
+        return 'MathJax ' + worker_pool.version + ' (workers)';
+      },
+      typeset: function (nodes, done) {
+        var visible = nodes.filter(in_viewport);
+        render_math(nodes, function (segment, callback, node) {
+          worker_output(segment, callback, visible.indexOf(node) === -1 ? 1 : 0, node);
+        }, function () { done(); });
+      }
+    }
+  };
+  var engine = mws_worker ? engines.worker : engines[mws_engine];
 
-  document.head.appendChild(mathjax_config);
-  document.head.appendChild(mathjax_observer);
-  document.head.appendChild(mathjax_script);
+  window.mathWithSlack = {
+    cache: function () {
+      return {
+        entries: render_cache.entries.size,
+        bytes: render_cache.bytes,
+        limit: mws_cache_size,
+        hits: render_cache.hits,
+        misses: render_cache.misses,
+        reused: edit_stats.reused,
+        bad: bad_tex.hashes.size
+      };
+    },
+    // Marks up the math under node as MathJax 2 scripts without rendering
+    // it, and returns the number of equations found (see benchmark/)
+    tokenize: function (node) {
+      var count = 0;
+      render_math([node], function (segment, callback) {
+        count++;
+        callback(math_script(segment));
+      }, function () {});
+      return count;
+    },
+    filter: function () {
+      return {
+        checked: filter_stats.checked,
+        rejected: filter_stats.rejected,
+        unchanged: filter_stats.unchanged,
+        ignored: filter_stats.ignored
+      };
+    },
+    // Number of nodes waiting to be typeset or being typeset
+    pending: queue_depth,
+    stats: stats,
+    timeline: timeline
+  };
+
+  observe_messages();
 });
+
+performance.mark('mws-eval');
 EOF
 
 
@@ -187,7 +1802,8 @@ ed -s $SLACK_SSB_INTEROP <<EOF > /dev/null
 i
   // ** math-with-slack $MWS_VERSION ** https://github.com/fsavje/math-with-slack
   var mwsp = path.join(__dirname, 'math-with-slack.js').replace('app.asar', 'app.asar.unpacked');
-  require('fs').readFile(mwsp, 'utf8', (e, r) => { if (e) { throw e; } else { eval(r); } });
+  performance.mark('mws-loader');
+  require('fs').readFile(mwsp, 'utf8', (e, r) => { if (e) { throw e; } else { performance.mark('mws-read'); eval(r); } });
 
 .
 w